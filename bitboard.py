@@ -0,0 +1,374 @@
+from game import Game, Move, Piece, tiles_to_edge, direction_offsets, knight_offsets, knight_dict
+import random, time
+
+#Bit i of a bitboard stands for tile i of Game.board (tile 0 is a8, tile 63 is h1)
+full_board = (1 << 64) - 1
+file_a = sum(1 << tile for tile in range(0, 64, 8))
+file_h = sum(1 << tile for tile in range(7, 64, 8))
+rank_1, rank_2, rank_7, rank_8 = 0xFF << 56, 0xFF << 48, 0xFF << 8, 0xFF
+
+
+#Precomputing the attack sets of knights, kings and pawns for each tile on the board
+knight_attacks, king_attacks = [], []
+pawn_attacks = {Piece.white: [], Piece.black: []}
+for tile in range(64):
+    attacks = 0
+    for offset in knight_offsets:
+        target_tile = tile + offset
+        if 0 <= target_tile <= 63 and abs(target_tile % 8 - tile % 8) <= 2:
+            attacks |= 1 << target_tile
+    knight_attacks.append(attacks)
+    attacks = 0
+    for dir in range(8):
+        if tiles_to_edge[tile][dir] >= 1:
+            attacks |= 1 << (tile + direction_offsets[dir])
+    king_attacks.append(attacks)
+    white_attacks, black_attacks = 0, 0
+    if tile % 8 > 0:
+        if tile >= 8: white_attacks |= 1 << (tile - 9)
+        if tile < 56: black_attacks |= 1 << (tile + 7)
+    if tile % 8 < 7:
+        if tile >= 8: white_attacks |= 1 << (tile - 7)
+        if tile < 56: black_attacks |= 1 << (tile + 9)
+    pawn_attacks[Piece.white].append(white_attacks)
+    pawn_attacks[Piece.black].append(black_attacks)
+
+
+#Precomputing the rays from each tile to the edge of the board in each direction (N->NE->E->SE->S->SW->W->NW)
+rays = [[0] * 64 for dir in range(8)]
+for tile in range(64):
+    for dir in range(8):
+        for dis in range(1, tiles_to_edge[tile][dir] + 1):
+            rays[dir][tile] |= 1 << (tile + direction_offsets[dir] * dis)
+#Directions where the tile number grows along the ray, the first blocker is then the lowest bit
+positive_dirs = (False, False, True, True, True, True, False, False)
+
+
+#Precomputing (direction, distance) of every queen-line and knight move, matching the encoding used in Game.all_moves
+move_shapes = [{} for tile in range(64)]
+for tile in range(64):
+    for dir in range(8):
+        for dis in range(1, tiles_to_edge[tile][dir] + 1):
+            move_shapes[tile][tile + direction_offsets[dir] * dis] = (dir, dis)
+    for offset in knight_offsets:
+        if 0 <= tile + offset <= 63 and knight_attacks[tile] >> (tile + offset) & 1:
+            move_shapes[tile][tile + offset] = (knight_dict[offset], 1)
+
+
+#Sliding attacks along one ray, stopping at (and including) the first occupied tile
+def ray_attacks(dir, tile, occupied):
+    attacks = rays[dir][tile]
+    blockers = attacks & occupied
+    if blockers:
+        if positive_dirs[dir]:
+            blocker = (blockers & -blockers).bit_length() - 1
+        else:
+            blocker = blockers.bit_length() - 1
+        attacks ^= rays[dir][blocker]
+    return attacks
+
+
+def bishop_attacks(tile, occupied):
+    return ray_attacks(1, tile, occupied) | ray_attacks(3, tile, occupied) \
+        | ray_attacks(5, tile, occupied) | ray_attacks(7, tile, occupied)
+
+
+def rook_attacks(tile, occupied):
+    return ray_attacks(0, tile, occupied) | ray_attacks(2, tile, occupied) \
+        | ray_attacks(4, tile, occupied) | ray_attacks(6, tile, occupied)
+
+
+#Returning the first tile of a bitboard met when walking from a tile along direction dir, or None if it is empty
+def first_tile(dir, bitboard):
+    if not bitboard:
+        return None
+    if positive_dirs[dir]:
+        return (bitboard & -bitboard).bit_length() - 1
+    return bitboard.bit_length() - 1
+
+
+#Yielding the tile number of every set bit in a bitboard
+def tiles_of(bitboard):
+    while bitboard:
+        low_bit = bitboard & -bitboard
+        yield low_bit.bit_length() - 1
+        bitboard ^= low_bit
+
+
+#Game which keeps one 64 bit integer per piece type and color next to the board, moves are generated with bit operations
+class BitboardGame(Game):
+    __slots__ = ('bitboards', 'occupancy')
+
+    def load_fen(self, fen):
+        #Indexed by piece value (ie Piece.white|Piece.knight), occupancy is indexed by color
+        self.bitboards = [0] * 23
+        self.occupancy = {Piece.white: 0, Piece.black: 0}
+        return super().load_fen(fen)
+
+    #Bitboards are plain integers, copying their containers is enough
+    def clone(self):
+        clone = super().clone()
+        clone.bitboards, clone.occupancy = self.bitboards[:], dict(self.occupancy)
+        return clone
+
+    def set_tile(self, tile, piece):
+        bit = 1 << tile
+        old_piece = self.board[tile]
+        if old_piece != Piece.none:
+            self.bitboards[old_piece] ^= bit
+            self.occupancy[old_piece & 24] ^= bit
+        if piece != Piece.none:
+            self.bitboards[piece] |= bit
+            self.occupancy[piece & 24] |= bit
+        super().set_tile(tile, piece)
+
+    #Checking if a tile is attacked by the given color, optionally with a different occupancy and with captured pieces removed
+    def is_square_attacked(self, tile, by_color, occupied = None, removed = 0):
+        bitboards = self.bitboards
+        if occupied == None:
+            occupied = self.occupancy[Piece.white] | self.occupancy[Piece.black]
+        if knight_attacks[tile] & bitboards[by_color|Piece.knight] & ~removed:
+            return True
+        if king_attacks[tile] & bitboards[by_color|Piece.king]:
+            return True
+        #A pawn of by_color attacks this tile from where a pawn of the other color standing here would attack
+        if pawn_attacks[by_color^24][tile] & bitboards[by_color|Piece.pawn] & ~removed:
+            return True
+        queens = bitboards[by_color|Piece.queen]
+        diagonal = (bitboards[by_color|Piece.bishop] | queens) & ~removed
+        if diagonal and bishop_attacks(tile, occupied) & diagonal:
+            return True
+        straight = (bitboards[by_color|Piece.rook] | queens) & ~removed
+        if straight and rook_attacks(tile, occupied) & straight:
+            return True
+        return False
+
+    #Checking if a given player is in check
+    def is_in_check(self, color):
+        king = self.bitboards[color|Piece.king]
+        if not king:
+            return False
+        return self.is_square_attacked(king.bit_length() - 1, color^24)
+
+    #Checking if attempted move is legal (ie does not put player in check) without copying the game
+    def is_legal_move(self, piece, start_tile, end_tile):
+        color = piece & 24
+        start_bit, end_bit = 1 << start_tile, 1 << end_tile
+        occupied = (self.occupancy[Piece.white] | self.occupancy[Piece.black]) & ~start_bit | end_bit
+        removed = end_bit
+        #En passant captures also take the pawn beside the end tile off the board
+        if piece & 7 == Piece.pawn and end_tile == self.en_passant_tile and start_tile % 8 != end_tile % 8:
+            captured_bit = 1 << (end_tile + 8 if color == Piece.white else end_tile - 8)
+            occupied &= ~captured_bit
+            removed |= captured_bit
+        if piece & 7 == Piece.king:
+            king_tile = end_tile
+        else:
+            king_tile = self.bitboards[color|Piece.king].bit_length() - 1
+        return not self.is_square_attacked(king_tile, color^24, occupied, removed)
+
+    #Finding every tile attacked by a color at once, sliders looking through the given occupancy
+    def attacked_tiles(self, by_color, occupied):
+        bitboards = self.bitboards
+        pawns = bitboards[by_color|Piece.pawn]
+        if by_color == Piece.white:
+            attacked = ((pawns & ~file_a) >> 9) | ((pawns & ~file_h) >> 7)
+        else:
+            attacked = (((pawns & ~file_a) << 7) | ((pawns & ~file_h) << 9)) & full_board
+        for tile in tiles_of(bitboards[by_color|Piece.knight]):
+            attacked |= knight_attacks[tile]
+        for tile in tiles_of(bitboards[by_color|Piece.bishop] | bitboards[by_color|Piece.queen]):
+            attacked |= bishop_attacks(tile, occupied)
+        for tile in tiles_of(bitboards[by_color|Piece.rook] | bitboards[by_color|Piece.queen]):
+            attacked |= rook_attacks(tile, occupied)
+        for tile in tiles_of(bitboards[by_color|Piece.king]):
+            attacked |= king_attacks[tile]
+        return attacked
+
+    #Finding the pieces checking a king and the pinned pieces beside it
+    #Returns the checkers, the tiles a non-king move must land on to answer a single check,
+    #and a dictionary from each pinned tile to the bitboard of its pin line
+    def checks_and_pins(self, color, king_tile, occupied):
+        bitboards = self.bitboards
+        opponent = color^24
+        checkers = (knight_attacks[king_tile] & bitboards[opponent|Piece.knight]) \
+            | (pawn_attacks[color][king_tile] & bitboards[opponent|Piece.pawn])
+        check_mask, pin_lines = checkers, {}
+        own = self.occupancy[color]
+        queens = bitboards[opponent|Piece.queen]
+        for dir in range(8):
+            sliders = (bitboards[opponent|Piece.rook] if dir % 2 == 0 else bitboards[opponent|Piece.bishop]) | queens
+            ray = rays[dir][king_tile]
+            if not ray & sliders:
+                continue
+            first = first_tile(dir, ray & occupied)
+            if first == None:
+                continue
+            if sliders >> first & 1:
+                checkers |= 1 << first
+                check_mask |= ray ^ rays[dir][first]
+            elif own >> first & 1:
+                second = first_tile(dir, rays[dir][first] & occupied)
+                if second != None and sliders >> second & 1:
+                    pin_lines[first] = ray ^ rays[dir][second]
+        return checkers, check_mask, pin_lines
+
+    #Generating moves for the color to move, landing non-king pieces only on check_mask (pinned ones only on their pin line)
+    #and the king only on king_mask. With the default masks these are all possible moves, including illegal ones
+    def generate_moves(self, check_mask = full_board, pin_lines = None, king_mask = full_board, en_passant = True):
+        moves = []
+        color = self.color_to_move
+        bitboards = self.bitboards
+        own, enemy = self.occupancy[color], self.occupancy[color^24]
+        occupied = own | enemy
+        empty = ~occupied & full_board
+        targets = ~own & full_board
+
+        #Taking care of knight, bishop, rook, queen and king moves
+        for piece_type in (Piece.knight, Piece.bishop, Piece.rook, Piece.queen, Piece.king):
+            piece = color|piece_type
+            for tile in tiles_of(bitboards[piece]):
+                if piece_type == Piece.knight: attacks = knight_attacks[tile]
+                elif piece_type == Piece.bishop: attacks = bishop_attacks(tile, occupied)
+                elif piece_type == Piece.rook: attacks = rook_attacks(tile, occupied)
+                elif piece_type == Piece.queen: attacks = bishop_attacks(tile, occupied) | rook_attacks(tile, occupied)
+                else: attacks = king_attacks[tile]
+                if piece_type == Piece.king: attacks &= king_mask
+                else: attacks &= check_mask
+                if pin_lines and tile in pin_lines:
+                    attacks &= pin_lines[tile]
+                shapes = move_shapes[tile]
+                for target_tile in tiles_of(attacks & targets):
+                    dir, dis = shapes[target_tile]
+                    moves.append(Move(piece, tile, target_tile, dir, dis))
+
+        #Taking care of pawn moves, shifting the whole pawn bitboard at once
+        piece = color|Piece.pawn
+        pawns = bitboards[piece]
+        captures = enemy
+        if en_passant and self.en_passant_tile != None:
+            captures |= 1 << self.en_passant_tile
+        if color == Piece.white:
+            single = (pawns >> 8) & empty
+            double = ((single & (rank_2 >> 8)) >> 8) & empty
+            pawn_targets = ((single, 8), (double, 16), (((pawns & ~file_a) >> 9) & captures, 9), (((pawns & ~file_h) >> 7) & captures, 7))
+            last_rank = rank_8
+        else:
+            single = (pawns << 8) & empty
+            double = ((single & (rank_7 << 8)) << 8) & empty
+            pawn_targets = ((single, -8), (double, -16), (((pawns & ~file_a) << 7) & captures, -7), (((pawns & ~file_h) << 9) & captures, -9))
+            last_rank = rank_1
+        for bitboard, back in pawn_targets:
+            for target_tile in tiles_of(bitboard & check_mask):
+                tile = target_tile + back
+                if pin_lines and tile in pin_lines and not pin_lines[tile] >> target_tile & 1:
+                    continue
+                dir, dis = move_shapes[tile][target_tile]
+                #Checking if pawn move is to last rank, if so add one move for knight promotion and one for queen promotion
+                if last_rank >> target_tile & 1:
+                    moves.append(Move(piece, tile, target_tile, dir, 1, 1))
+                    moves.append(Move(piece, tile, target_tile, dir, 1, 2))
+                else:
+                    moves.append(Move(piece, tile, target_tile, dir, dis))
+        return moves
+
+    #Computing all possible moves on board, computes illegal moves as well that check is done after this computation
+    def compute_moves(self, include_castling = True):
+        moves = self.generate_moves()
+        if include_castling:
+            moves.extend(self.castling_moves())
+        return moves
+
+    #Computing castling moves, the king may not castle out of, through or into check
+    def castling_moves(self):
+        moves = []
+        occupied = self.occupancy[Piece.white] | self.occupancy[Piece.black]
+        if self.color_to_move == Piece.white:
+            king, rook = Piece.white|Piece.king, Piece.white|Piece.rook
+            if self.castling & 1 and self.board[60] == king and self.board[63] == rook and not occupied & (0b11 << 61) \
+                and not any(self.is_square_attacked(tile, Piece.black, occupied) for tile in (60, 61, 62)):
+                moves.append(Move(king, 60, 62, 2, 2))
+            if self.castling & 2 and self.board[60] == king and self.board[56] == rook and not occupied & (0b111 << 57) \
+                and not any(self.is_square_attacked(tile, Piece.black, occupied) for tile in (60, 59, 58)):
+                moves.append(Move(king, 60, 58, 6, 2))
+        else:
+            king, rook = Piece.black|Piece.king, Piece.black|Piece.rook
+            if self.castling & 4 and self.board[4] == king and self.board[7] == rook and not occupied & (0b11 << 5) \
+                and not any(self.is_square_attacked(tile, Piece.white, occupied) for tile in (4, 5, 6)):
+                moves.append(Move(king, 4, 6, 2, 2))
+            if self.castling & 8 and self.board[4] == king and self.board[0] == rook and not occupied & (0b111 << 1) \
+                and not any(self.is_square_attacked(tile, Piece.white, occupied) for tile in (4, 3, 2)):
+                moves.append(Move(king, 4, 2, 6, 2))
+        return moves
+
+    #Generating the list of all legal moves for current game
+    #Checkers, pins and attacked tiles are found once and turned into target masks, so only legal moves are generated
+    def generate_legal_moves(self):
+        color = self.color_to_move
+        king = self.bitboards[color|Piece.king]
+        if not king:
+            return [move for move in self.compute_moves() if self.is_legal_move(move.piece, move.start_tile, move.end_tile)]
+        king_tile = king.bit_length() - 1
+        occupied = self.occupancy[Piece.white] | self.occupancy[Piece.black]
+        checkers, check_mask, pin_lines = self.checks_and_pins(color, king_tile, occupied)
+        #The king is taken off the board so it cannot hide behind itself along a checking ray
+        king_mask = ~self.attacked_tiles(color^24, occupied & ~king) & full_board
+        if not checkers:
+            check_mask = full_board
+        #Only the king can answer a double check
+        elif checkers & (checkers - 1):
+            check_mask = 0
+        legal_moves = self.generate_moves(check_mask, pin_lines, king_mask, en_passant=False)
+
+        #En passant removes two pieces from a rank, which can uncover a check no pin covers, so it is tested separately
+        if self.en_passant_tile != None:
+            piece = color|Piece.pawn
+            for tile in tiles_of(pawn_attacks[color^24][self.en_passant_tile] & self.bitboards[piece]):
+                if self.is_legal_move(piece, tile, self.en_passant_tile):
+                    dir, dis = move_shapes[tile][self.en_passant_tile]
+                    legal_moves.append(Move(piece, tile, self.en_passant_tile, dir, dis))
+        if not checkers:
+            legal_moves.extend(self.castling_moves())
+        return legal_moves
+
+
+#Checking the bitboard generator against Game on random self-play positions and timing both
+def compare_engines(num_games = 2, max_moves = 20, seed = 0):
+    rng = random.Random(seed)
+    positions, list_time, bitboard_time, list_count, bitboard_count = 0, 0.0, 0.0, 0, 0
+    for i in range(num_games):
+        game, bitboard_game = Game(), BitboardGame()
+        while game.status == None and len(game.executed_moves) < max_moves:
+            #Timing the generators themselves, get_legal_moves would mostly read the moves make_move already cached
+            t0 = time.perf_counter()
+            list_moves = game.generate_legal_moves()
+            t1 = time.perf_counter()
+            bitboard_moves = bitboard_game.generate_legal_moves()
+            t2 = time.perf_counter()
+            list_time, bitboard_time = list_time + (t1 - t0), bitboard_time + (t2 - t1)
+            list_count, bitboard_count = list_count + len(list_moves), bitboard_count + len(bitboard_moves)
+            positions += 1
+
+            list_set = {(m.piece, m.start_tile, m.end_tile, m.direction, m.distance, m.promotion) for m in list_moves}
+            bitboard_set = {(m.piece, m.start_tile, m.end_tile, m.direction, m.distance, m.promotion) for m in bitboard_moves}
+            if list_set != bitboard_set:
+                raise AssertionError('Engines disagree in game ' + str(i) + ' after moves '
+                    + str([(m.start_tile, m.end_tile) for m in game.executed_moves])
+                    + ': only list ' + str(list_set - bitboard_set) + ', only bitboard ' + str(bitboard_set - list_set))
+
+            index = rng.randrange(len(list_moves))
+            game.execute_move(list_moves[index])
+            bitboard_game.execute_move(bitboard_moves[[
+                (m.start_tile, m.end_tile, m.promotion) for m in bitboard_moves].index(
+                (list_moves[index].start_tile, list_moves[index].end_tile, list_moves[index].promotion))])
+            if game.board != bitboard_game.board:
+                raise AssertionError('Boards differ after move ' + str(len(game.executed_moves)) + ' of game ' + str(i))
+
+    print('Positions compared: ' + str(positions))
+    print('Game:         ' + str(round(list_count / list_time)) + ' moves/second')
+    print('BitboardGame: ' + str(round(bitboard_count / bitboard_time)) + ' moves/second')
+    print('Speedup:      ' + str(round(list_time / bitboard_time, 1)) + 'x')
+
+
+if __name__ == '__main__':
+    compare_engines()
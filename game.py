@@ -1,4 +1,5 @@
-import copy, collections
+import collections, random, threading
+import numpy
 
 #Starting board FEN
 fen_initial = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
@@ -32,7 +33,7 @@ knight_dict = {-17:0, -15:1, -10:2, -6:3, 6:4, 10:5, 15:6, 17:7}
 
 
 #Class which defines numerical values for both type of piece and color of piece
-#pawn:1, bishop:2, knight:3, rook:4, queen:5, king:6, white:8, black:16
+#pawn:1, bishop:2, knight:3, rook:4, queen:5, king:6, white:8, black:16, empty tiles hold none:0
 class Piece():
     pawn = 1
     bishop = 2
@@ -42,6 +43,68 @@ class Piece():
     king = 6
     white = 8
     black = 16
+    none = 0
+
+
+#Precomputing per tile the tiles along each direction (nearest first), and the knight, king and pawn capture
+#jumps as (target tile, direction) pairs, built once and shared by every game
+rays = tuple(tuple(tuple(tile + direction_offsets[dir] * dis for dis in range(1, tiles_to_edge[tile][dir] + 1))
+    for dir in range(8)) for tile in range(64))
+knight_targets = tuple(tuple((tile + offset, knight_dict[offset]) for offset in knight_offsets
+    if 0 <= tile + offset <= 63 and abs((tile + offset) % 8 - tile % 8) <= 2) for tile in range(64))
+king_targets = tuple(tuple((tile + direction_offsets[dir], dir) for dir in range(8) if tiles_to_edge[tile][dir] >= 1)
+    for tile in range(64))
+#White pawns capture NE/NW, black pawns SE/SW
+pawn_captures = {color: tuple(tuple((tile + direction_offsets[dir], dir) for dir in dirs if tiles_to_edge[tile][dir] >= 1)
+    for tile in range(64)) for color, dirs in ((Piece.white, (1, 7)), (Piece.black, (3, 5)))}
+#Directions each sliding piece moves along, bishops on the odd ones and rooks on the even ones
+slider_directions = {Piece.bishop: (1, 3, 5, 7), Piece.rook: (0, 2, 4, 6), Piece.queen: (0, 1, 2, 3, 4, 5, 6, 7)}
+
+
+#Helper function to get constant list of all possible
+def get_all_moves():
+    all_moves = []
+    for start_tile in range(64):
+        for dir in range(8):
+            for dis in range(1,8):
+                offset = direction_offsets[dir]
+                end_tile = start_tile + (offset * dis)
+                all_moves.append((start_tile, end_tile, dir, dis, None))
+        for offset in knight_offsets:
+            end_tile = start_tile + offset
+            all_moves.append((start_tile, end_tile, knight_dict[offset], 1, None))
+        for dir in (0,1,3,4,5,7):
+            for promotion in (1,2):
+                end_tile = start_tile + direction_offsets[dir]
+                all_moves.append((start_tile, end_tile, dir, 1, promotion))
+    return all_moves
+
+
+#Constant list of all possible moves, shared by every game, and the inverse dictionary from move tuple to its index in that list
+all_moves = tuple(get_all_moves())
+move_indexes = {move: index for index, move in enumerate(all_moves)}
+
+
+#King (start, end) tiles of each castle and the (start, end) tiles of the rook moving with it
+castle_rooks = {(60, 62): (63, 61), (60, 58): (56, 59), (4, 6): (7, 5), (4, 2): (0, 3)}
+
+
+#FEN characters and the piece values they stand for
+fen_pieces = {'P': Piece.white|Piece.pawn, 'B': Piece.white|Piece.bishop, 'N': Piece.white|Piece.knight,
+    'R': Piece.white|Piece.rook, 'Q': Piece.white|Piece.queen, 'K': Piece.white|Piece.king,
+    'p': Piece.black|Piece.pawn, 'b': Piece.black|Piece.bishop, 'n': Piece.black|Piece.knight,
+    'r': Piece.black|Piece.rook, 'q': Piece.black|Piece.queen, 'k': Piece.black|Piece.king}
+
+
+#Network input plane of each piece value, white pawn, rook, knight, bishop, queen, king then the same for black
+piece_planes = [None] * 23
+for color, offset in ((Piece.white, 0), (Piece.black, 6)):
+    for plane, piece_type in enumerate((Piece.pawn, Piece.rook, Piece.knight, Piece.bishop, Piece.queen, Piece.king)):
+        piece_planes[color|piece_type] = plane + offset
+
+#Number of boards encoded in the network input, the current one and the ones before it, newest first
+history_length = 8
+history_order = numpy.arange(history_length)
 
 
 #Class for a specific move
@@ -54,68 +117,157 @@ class Move(object):
         self.distance = distance
         self.promotion = promotion
 
+    #Position of this move in the list of all possible moves (ie the network policy output)
+    def index(self):
+        return move_indexes[(self.start_tile, self.end_tile, self.direction, self.distance, self.promotion)]
+
+
+#Random 64 bit keys for Zobrist hashing, seeded so every process hashes positions the same way
+zobrist_random = random.Random(2021)
+#Indexed by piece value then tile
+zobrist_pieces = [[zobrist_random.getrandbits(64) for tile in range(64)] for piece in range(23)]
+zobrist_black_to_move = zobrist_random.getrandbits(64)
+#Indexed by castling rights packed as K=1, Q=2, k=4, q=8
+zobrist_castling = [zobrist_random.getrandbits(64) for rights in range(16)]
+zobrist_en_passant = [zobrist_random.getrandbits(64) for tile in range(64)]
+
+
+#Everything make_move changes that cannot be recomputed from the move itself, used by unmake_move
+Undo = collections.namedtuple('Undo', ['move', 'captured', 'captured_tile', 'castling',
+    'en_passant_tile', 'half_move_count', 'status', 'evicted_planes', 'legal_entry'])
+
+
+#Bounded map from position hash to the [legal moves, policy indexes] entry of that position, shared by every game
+#when assigned to Game.legal_move_table, least recently used positions are dropped first
+#Games searched in parallel threads share the table, so lookups and insertions hold its lock
+class LegalMoveTable(object):
+    def __init__(self, size):
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.hits, self.misses = 0, 0
+        self.lock = threading.Lock()
+
+    def get(self, hash):
+        with self.lock:
+            entry = self.entries.get(hash)
+            if entry == None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(hash)
+            return entry
+
+    def put(self, hash, entry):
+        with self.lock:
+            if len(self.entries) >= self.size:
+                self.entries.popitem(last=False)
+            self.entries[hash] = entry
+
+    def __len__(self):
+        return len(self.entries)
+
+
+#Compact record of a single position, small enough to keep tens of thousands alive at once
+#The board is a bytearray of piece values and the castling rights are packed as K=1, Q=2, k=4, q=8
+class Position(object):
+    __slots__ = ('board', 'color_to_move', 'castling', 'en_passant_tile', 'half_move_count', 'full_move_count',
+        'status', 'hash')
+
+    @property
+    def K(self):
+        return self.castling & 1 != 0
+
+    @property
+    def Q(self):
+        return self.castling & 2 != 0
+
+    @property
+    def k(self):
+        return self.castling & 4 != 0
+
+    @property
+    def q(self):
+        return self.castling & 8 != 0
+
+    #Packing the castling flags into one number (K=1, Q=2, k=4, q=8)
+    def castling_rights(self):
+        return self.castling
+
+    #Computing the Zobrist hash of the position from scratch, make_move keeps self.hash equal to this incrementally
+    def compute_hash(self):
+        hash = 0
+        for tile in range(64):
+            if self.board[tile] != Piece.none: hash ^= zobrist_pieces[self.board[tile]][tile]
+        if self.color_to_move == Piece.black: hash ^= zobrist_black_to_move
+        hash ^= zobrist_castling[self.castling]
+        if self.en_passant_tile != None: hash ^= zobrist_en_passant[self.en_passant_tile]
+        return hash
+
+    #Copying the position fields onto another object, the board is the only mutable one
+    def copy_position(self, other):
+        other.board, other.color_to_move, other.castling = bytearray(self.board), self.color_to_move, self.castling
+        other.en_passant_tile, other.half_move_count, other.full_move_count = self.en_passant_tile, self.half_move_count, self.full_move_count
+        other.status, other.hash = self.status, self.hash
+        return other
+
+    #New Position holding only this position, Position.clone(game) takes a bare snapshot of a game
+    def clone(self):
+        return self.copy_position(Position.__new__(Position))
+
+
+#Class for the game as a whole, the position plus the scratch state make_move/unmake_move need while searching
+#(undo stack, hash history, input planes) and the records kept for training (encodings, visits, moves)
+class Game(Position):
+    __slots__ = ('undo_stack', 'hash_history', 'board_planes', 'planes_head', 'legal_entry',
+        'node_visits', 'encoding_history', 'executed_moves', 'start_fen', 'root_visits')
+    #The constant list of all possible moves lives at module level, games only reference it
+    all_moves = all_moves
+    #Optional LegalMoveTable reused across games, None keeps legal moves cached per position only
+    legal_move_table = None
 
-#Class for the game as a whole, keeps track of castling potential, en passant capture tile, move counts
-class Game(object):
     def __init__(self, fen = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1' ):
         self.load_fen(fen)
-        self.history = [None, None, None, None, None, None, None]
         self.node_visits = []
         self.encoding_history = [self.encode_input()]
-        self.all_moves = get_all_moves()
         self.executed_moves = []
+        #Position the game started from and the (moves, visit counts) of every root searched, for game records
+        self.start_fen = fen
+        self.root_visits = []
     
     #Taking in FEN string as argument and loading necessary values into game variables
     def load_fen(self,fen):
         split = fen.split()
-        self.board, self.color_to_move, self.full_move_count, self.half_move_count = [], 0, 0, 0 
-        self.K, self.Q, self.k, self.q, self.en_passant_tile = False, False, False, False, None
+        self.board, self.color_to_move, self.full_move_count, self.half_move_count = bytearray(64), 0, 0, 0
+        self.castling, self.en_passant_tile = 0, None
+        self.status, self.undo_stack, self.hash, self.legal_entry = None, [], 0, None
+        #Ring buffer of piece planes for the current board and the 7 before it, the slot at planes_head is the current board
+        self.board_planes, self.planes_head = numpy.zeros((history_length, 8, 8, 12), dtype = numpy.uint8), 0
+        tile = 0
         for char in split[0]:
-            if char == 'P':
-                self.board.append(Piece.white | Piece.pawn)
-            elif char == 'p':
-                self.board.append(Piece.black | Piece.pawn)
-            elif char == 'B':
-                self.board.append(Piece.white | Piece.bishop)
-            elif char == 'b':
-                self.board.append(Piece.black | Piece.bishop)
-            elif char == 'N':
-                self.board.append(Piece.white | Piece.knight)
-            elif char == 'n':
-                self.board.append(Piece.black | Piece.knight)
-            elif char == 'R':
-                self.board.append(Piece.white | Piece.rook)
-            elif char == 'r':
-                self.board.append(Piece.black | Piece.rook)
-            elif char == 'Q':
-                self.board.append(Piece.white | Piece.queen)
-            elif char == 'q':
-                self.board.append(Piece.black | Piece.queen)
-            elif char == 'K':
-                self.board.append(Piece.white | Piece.king)
-            elif char == 'k':
-                self.board.append(Piece.black | Piece.king)
+            if char in fen_pieces:
+                self.set_tile(tile, fen_pieces[char])
+                tile += 1
             elif char.isdigit():
-                empty_squares = int(char)
-                for i in range(empty_squares):
-                    self.board.append(None)
+                tile += int(char)
         if split[1] == 'w':
             self.color_to_move = Piece.white
         else:
             self.color_to_move = Piece.black
-        if 'K' in split[2]: self.K = True
-        if 'Q' in split[2]: self.Q = True
-        if 'k' in split[2]: self.k = True
-        if 'q' in split[2]: self.q = True
+        for bit, char in enumerate('KQkq'):
+            if char in split[2]: self.castling |= 1 << bit
         if split[3] != '-':
             self.en_passant_tile = chess_square_to_tile(split[3])
         self.half_move_count = float(split[4])
         if int(split[5]) == 1: self.full_move_count = 0
         else: self.full_move_count = int(split[5])
+        #Pieces were hashed as they were placed, adding the rest of the position
+        if self.color_to_move == Piece.black: self.hash ^= zobrist_black_to_move
+        self.hash ^= zobrist_castling[self.castling]
+        if self.en_passant_tile != None: self.hash ^= zobrist_en_passant[self.en_passant_tile]
+        self.hash_history = [self.hash]
 
         #Checking game status
-        possible_moves = self.compute_moves()
-        legal_moves = self.prune_possible_moves(possible_moves)
+        legal_moves = self.get_legal_moves()
 
         #Checking win/draw conditions
         if legal_moves == [] and self.is_in_check(self.color_to_move):
@@ -124,7 +276,31 @@ class Game(object):
         elif (legal_moves == [] and not self.is_in_check(self.color_to_move)) or self.half_move_count >= 50: self.status = 0
         else: self.status = None
         return self
-    
+
+    #New Game continuing from this position, only the position and the input planes are copied,
+    #the undo stack and training records start empty
+    def clone(self):
+        clone = self.copy_position(self.__class__.__new__(self.__class__))
+        #The hashes of the boards in the input planes are kept as well, they identify the network input
+        clone.undo_stack, clone.hash_history = [], self.hash_history[-history_length:]
+        clone.board_planes, clone.planes_head = self.board_planes.copy(), self.planes_head
+        clone.legal_entry = self.legal_entry
+        clone.node_visits, clone.encoding_history, clone.executed_moves = [], [], []
+        #A FEN cannot hold the boards before the position, so the records of a clone cannot be replayed
+        clone.start_fen, clone.root_visits = None, []
+        return clone
+
+    #Placing a piece (or Piece.none) on a tile, every board change goes through here so engines can keep their own state in sync
+    def set_tile(self, tile, piece):
+        planes = self.board_planes[self.planes_head, tile >> 3, tile & 7]
+        if self.board[tile] != Piece.none:
+            self.hash ^= zobrist_pieces[self.board[tile]][tile]
+            planes[piece_planes[self.board[tile]]] = 0
+        if piece != Piece.none:
+            self.hash ^= zobrist_pieces[piece][tile]
+            planes[piece_planes[piece]] = 1
+        self.board[tile] = piece
+
     #Return color of piece
     def get_piece_color(self, piece):
         if piece < 16:
@@ -133,27 +309,104 @@ class Game(object):
             piece_color = Piece.black
         return piece_color
 
-    #Checking if attempted move is legal (ie does not put player in check)
+    #Checking if attempted move is legal (ie does not put player in check), playing it in place and taking it back
     def is_legal_move(self, piece, start_tile, end_tile):
-        flag = False
         color = self.get_piece_color(piece)
-        temp_game = copy.deepcopy(self)
-        temp_game.board[start_tile] = None
-        temp_game.board[end_tile] = piece
-        if not temp_game.is_in_check(color): flag = True
+        self.make_move(Move(piece, start_tile, end_tile, None, None), update_status=False)
+        flag = not self.is_in_check(color)
+        self.unmake_move()
         return flag
 
     #Checking if a given player is in check
     def is_in_check(self, color):
-        in_check = False
-        self.full_move_count+=1
-        self.color_to_move = self.color_to_move^24
-        opponent_moves = self.compute_moves()
-        for move in opponent_moves:
-            if self.board[move.end_tile] == color|Piece.king:
-                in_check = True
-        return in_check
-    
+        if color|Piece.king not in self.board:
+            return False
+        return self.is_square_attacked(self.board.index(color|Piece.king), color^24)
+
+    #Checking if any piece of by_color attacks a tile, looking outwards from the tile instead of generating moves
+    def is_square_attacked(self, tile, by_color):
+        board = self.board
+        #A pawn attacks this tile from where a pawn of the other color standing here would capture
+        for target_tile, dir in pawn_captures[by_color^24][tile]:
+            if board[target_tile] == by_color|Piece.pawn:
+                return True
+        for target_tile, dir in knight_targets[tile]:
+            if board[target_tile] == by_color|Piece.knight:
+                return True
+        for i in range(8):
+            #Bishops slide along odd directions, rooks along even ones
+            slider = by_color|(Piece.rook if i % 2 == 0 else Piece.bishop)
+            for j, target_tile in enumerate(rays[tile][i]):
+                target_tile_piece = board[target_tile]
+                if target_tile_piece == Piece.none:
+                    continue
+                if target_tile_piece == slider or target_tile_piece == by_color|Piece.queen \
+                    or (j == 0 and target_tile_piece == by_color|Piece.king):
+                    return True
+                break
+        return False
+
+    #Finding the tiles attacked by a color in one pass, ignoring the piece on the ignored tile (the king escaping a slider)
+    def attacked_tiles(self, by_color, ignored_tile = None):
+        board = self.board
+        attacked = [False] * 64
+        for tile in range(64):
+            piece = board[tile]
+            if piece == Piece.none or piece & 24 != by_color:
+                continue
+            piece_val = piece - by_color
+            if piece_val in slider_directions:
+                for i in slider_directions[piece_val]:
+                    for target_tile in rays[tile][i]:
+                        attacked[target_tile] = True
+                        if board[target_tile] != Piece.none and target_tile != ignored_tile:
+                            break
+            else:
+                if piece_val == Piece.pawn: targets = pawn_captures[by_color][tile]
+                elif piece_val == Piece.knight: targets = knight_targets[tile]
+                else: targets = king_targets[tile]
+                for target_tile, dir in targets:
+                    attacked[target_tile] = True
+        return attacked
+
+    #Finding the pieces giving check and the pinned pieces of a color, walking the eight rays and knight jumps from its king
+    #Returns the checking tiles, the tiles a non-king move must land on to answer a single check,
+    #and a dictionary from each pinned tile to the tiles along its pin line
+    def checks_and_pins(self, color):
+        board = self.board
+        king_tile = board.index(color|Piece.king)
+        opponent = color^24
+        checkers, check_tiles, pins = [], set(), {}
+        for i in range(8):
+            slider = opponent|(Piece.rook if i % 2 == 0 else Piece.bishop)
+            line, pinned_tile = [], None
+            for target_tile in rays[king_tile][i]:
+                line.append(target_tile)
+                target_tile_piece = board[target_tile]
+                if target_tile_piece == Piece.none:
+                    continue
+                if target_tile_piece & 24 == color:
+                    if pinned_tile != None:
+                        break
+                    pinned_tile = target_tile
+                    continue
+                if target_tile_piece == slider or target_tile_piece == opponent|Piece.queen:
+                    if pinned_tile == None:
+                        checkers.append(target_tile)
+                        check_tiles.update(line)
+                    else:
+                        pins[pinned_tile] = set(line)
+                break
+        for target_tile, dir in knight_targets[king_tile]:
+            if board[target_tile] == opponent|Piece.knight:
+                checkers.append(target_tile)
+                check_tiles.add(target_tile)
+        for target_tile, dir in pawn_captures[color][king_tile]:
+            if board[target_tile] == opponent|Piece.pawn:
+                checkers.append(target_tile)
+                check_tiles.add(target_tile)
+        return checkers, check_tiles, pins
+
     #Taking all possible moves and returning moves which are not legal (ie moves putting yourself in check, etc.)
     def prune_possible_moves(self, possible_moves):
         all_legal_moves = []
@@ -171,203 +424,202 @@ class Game(object):
         return flag
     
     #Computing all possible moves on board, computes illegal moves as well that check is done after this computation
-    def compute_moves(self):
+    #Castling is skipped when only attacked tiles are needed, since a castle can never capture
+    def compute_moves(self, include_castling = True):
         moves = []
-        offsets = [-8, -7, 1, 9, 8, 7, -1, -9]
-        en_passant_move, castle_move = None, None
+        board, color = self.board, self.color_to_move
+        forward = -8 if color == Piece.white else 8
+        start_row = 6 if color == Piece.white else 1
         for tile in range(64):
-            knight_offsets = []
-            king_offsets = [-8,8]
-            if self.board[tile] != None:
-                if self.get_piece_color(self.board[tile]) == self.color_to_move:
-                    piece_val = self.board[tile] - self.color_to_move
-                    #Taking care of sliding moves (rook, bishop, queen)
-                    for i in range(8):
-                        if (piece_val == Piece.bishop and i % 2 != 0) or (piece_val == Piece.rook and i % 2 == 0) or piece_val == Piece.queen:
-                            for j in range(tiles_to_edge[tile][i]):
-                                target_tile = tile + offsets[i] * (j + 1)
-                                target_tile_piece = self.board[target_tile]
-                                if target_tile_piece != None and self.get_piece_color(target_tile_piece) == self.color_to_move:
-                                    break
-                                found_move = Move(self.board[tile], tile, target_tile, i, j+1)
-                                moves.append(found_move)
-                                if target_tile_piece != None and self.get_piece_color(target_tile_piece) != self.color_to_move:
-                                    break
-                    #Taking care of knight moves
-                    if piece_val == Piece.knight:
-                        if tiles_to_edge[tile][2] >= 1: 
-                            knight_offsets.append(-15)
-                            knight_offsets.append(17)
-                        if tiles_to_edge[tile][2] >= 2: 
-                            knight_offsets.append(10)
-                            knight_offsets.append(-6)
-                        if tiles_to_edge[tile][6] >= 1: 
-                            knight_offsets.append(15)
-                            knight_offsets.append(-17)
-                        if tiles_to_edge[tile][6] >= 2: 
-                            knight_offsets.append(-10)
-                            knight_offsets.append(6)
-                        for offset in knight_offsets:
-                            target_tile = tile + offset
-                            if target_tile >= 0 and target_tile <= 63:
-                                target_tile_piece = self.board[target_tile]
-                                if target_tile_piece != None and self.get_piece_color(target_tile_piece) == self.color_to_move:
-                                    continue
-                                found_move = Move(self.board[tile], tile, target_tile, knight_dict[offset], 1)
-                                moves.append(found_move)
-                    #Taking care of king moves excluding castling
-                    if piece_val == Piece.king:
-                        if tiles_to_edge[tile][2] >= 1: 
-                            king_offsets.append(-7)
-                            king_offsets.append(1)
-                            king_offsets.append(9)
-                        if tiles_to_edge[tile][6] >= 1: 
-                            king_offsets.append(7)
-                            king_offsets.append(-1)
-                            king_offsets.append(-9)
-                        for offset in king_offsets:
-                            target_tile = tile + offset
-                            if target_tile >= 0 and target_tile <= 63:
-                                target_tile_piece = self.board[target_tile]
-                                if target_tile_piece != None and self.get_piece_color(target_tile_piece) == self.color_to_move:
-                                    continue
-                                found_move = Move(self.board[tile], tile, target_tile, dir_dict[offset], 1)
-                                moves.append(found_move)
-                    #taking care of pawn moves excluding en passant moves
-                    if piece_val == Piece.pawn:
-                        pawn_moves = []
-                        if self.color_to_move == 8:
-                            change, right, left = -8, -7, -9
-                            if tiles_to_edge[tile][6] >= 1 and tile+left >=0 and tile+left <= 63:
-                                if self.board[tile+left] != None and self.get_piece_color(self.board[tile+left]) != self.color_to_move:
-                                    found_move = Move(self.board[tile], tile, tile+left, dir_dict[left], 1)
-                                    pawn_moves.append(found_move)
-                            if tiles_to_edge[tile][2] >= 1 and tile+right >=0 and tile+right <= 63:
-                                if self.board[tile+right] != None and self.get_piece_color(self.board[tile+right]) != self.color_to_move:
-                                    found_move = Move(self.board[tile], tile, tile+right, dir_dict[right], 1)
-                                    pawn_moves.append(found_move)
-                            if tile // 8 == 6 and self.board[tile - 16] == None:
-                                temp = 2
-                            else:
-                                temp = 1
-                        else:
-                            change, right, left = 8, 7, 9
-                            if tiles_to_edge[tile][2] >= 1 and tile+left >=0 and tile+left <= 63:
-                                if self.board[tile+left] != None and self.get_piece_color(self.board[tile+left]) != self.color_to_move:
-                                    found_move = Move(self.board[tile], tile, tile+left, dir_dict[left], 1)
-                                    pawn_moves.append(found_move)
-                            if tiles_to_edge[tile][6] >= 1 and tile+right >=0 and tile+right <= 63:
-                                if self.board[tile+right] != None and self.get_piece_color(self.board[tile+right]) != self.color_to_move:
-                                    found_move = Move(self.board[tile], tile, tile+right, dir_dict[right], 1)
-                                    pawn_moves.append(found_move)
-                            if tile // 8 == 1 and self.board[tile + 16] == None:
-                                temp = 2
-                            else:
-                                temp = 1
-                        for i in range(temp):
-                            target_tile = tile + (change * (i + 1))
-                            if target_tile >= 0 and target_tile <= 63:
-                                target_tile_piece = self.board[target_tile]
-                                if target_tile_piece != None:
-                                    continue
-                                found_move = Move(self.board[tile], tile, target_tile, dir_dict[change], i+1)
-                                pawn_moves.append(found_move)
-                        #Checking if pawn move is to last rank, if so add one move for knight promotion and one for queen promotion
-                        for pawn_move in pawn_moves:
-                            if (pawn_move.end_tile >=0 and pawn_move.end_tile<=7) or (pawn_move.end_tile >=56 and pawn_move.end_tile<=63):
-                                knight_promotion = Move(pawn_move.piece, pawn_move.start_tile, pawn_move.end_tile, pawn_move.direction, 1, 1)
-                                queen_promotion = Move(pawn_move.piece, pawn_move.start_tile, pawn_move.end_tile, pawn_move.direction, 1, 2)
-                                moves.append(knight_promotion)
-                                moves.append(queen_promotion)
-                            else: moves.append(pawn_move)
+            piece = board[tile]
+            if piece == Piece.none or piece & 24 != color:
+                continue
+            piece_val = piece - color
+            #Taking care of sliding moves (rook, bishop, queen)
+            if piece_val in slider_directions:
+                for i in slider_directions[piece_val]:
+                    for j, target_tile in enumerate(rays[tile][i]):
+                        target_tile_piece = board[target_tile]
+                        if target_tile_piece != Piece.none and target_tile_piece & 24 == color:
+                            break
+                        moves.append(Move(piece, tile, target_tile, i, j+1))
+                        if target_tile_piece != Piece.none:
+                            break
+            #Taking care of knight moves and king moves excluding castling
+            elif piece_val == Piece.knight or piece_val == Piece.king:
+                for target_tile, dir in (knight_targets[tile] if piece_val == Piece.knight else king_targets[tile]):
+                    target_tile_piece = board[target_tile]
+                    if target_tile_piece != Piece.none and target_tile_piece & 24 == color:
+                        continue
+                    moves.append(Move(piece, tile, target_tile, dir, 1))
+            #taking care of pawn moves excluding en passant moves
+            else:
+                pawn_moves = []
+                for target_tile, dir in pawn_captures[color][tile]:
+                    target_tile_piece = board[target_tile]
+                    if target_tile_piece != Piece.none and target_tile_piece & 24 != color:
+                        pawn_moves.append((target_tile, dir, 1))
+                target_tile = tile + forward
+                if 0 <= target_tile <= 63 and board[target_tile] == Piece.none:
+                    pawn_moves.append((target_tile, dir_dict[forward], 1))
+                    if tile // 8 == start_row and board[target_tile + forward] == Piece.none:
+                        pawn_moves.append((target_tile + forward, dir_dict[forward], 2))
+                #Checking if pawn move is to last rank, if so add one move for knight promotion and one for queen promotion
+                for target_tile, dir, dis in pawn_moves:
+                    if target_tile <= 7 or target_tile >= 56:
+                        moves.append(Move(piece, tile, target_tile, dir, 1, 1))
+                        moves.append(Move(piece, tile, target_tile, dir, 1, 2))
+                    else:
+                        moves.append(Move(piece, tile, target_tile, dir, dis))
         #Taking care of en passant moves
+        #The capturing pawn sits one rank behind the en passant tile, on either neighbouring file
         if self.en_passant_tile != None:
+            file = self.en_passant_tile % 8
             if self.color_to_move == Piece.white:
-                if self.board[self.en_passant_tile + 7] == Piece.white|Piece.pawn:
-                    en_passant_move = Move(self.board[self.en_passant_tile + 7], self.en_passant_tile + 7, self.en_passant_tile, dir_dict[7], 1)
+                if file > 0 and self.board[self.en_passant_tile + 7] == Piece.white|Piece.pawn:
+                    en_passant_move = Move(self.board[self.en_passant_tile + 7], self.en_passant_tile + 7, self.en_passant_tile, dir_dict[-7], 1)
                     moves.append(en_passant_move)
-                if self.board[self.en_passant_tile + 9] == Piece.white|Piece.pawn:
-                    en_passant_move = Move(self.board[self.en_passant_tile + 9], self.en_passant_tile + 9, self.en_passant_tile, dir_dict[9], 1)
+                if file < 7 and self.board[self.en_passant_tile + 9] == Piece.white|Piece.pawn:
+                    en_passant_move = Move(self.board[self.en_passant_tile + 9], self.en_passant_tile + 9, self.en_passant_tile, dir_dict[-9], 1)
                     moves.append(en_passant_move)
             elif self.color_to_move == Piece.black:
-                if self.board[self.en_passant_tile - 7] == Piece.black|Piece.pawn:
-                    en_passant_move = Move(self.board[self.en_passant_tile - 7], self.en_passant_tile - 7, self.en_passant_tile, dir_dict[-7], 1)
+                if file < 7 and self.board[self.en_passant_tile - 7] == Piece.black|Piece.pawn:
+                    en_passant_move = Move(self.board[self.en_passant_tile - 7], self.en_passant_tile - 7, self.en_passant_tile, dir_dict[7], 1)
                     moves.append(en_passant_move)
-                if self.board[self.en_passant_tile - 9] == Piece.black|Piece.pawn:
-                    en_passant_move = Move(self.board[self.en_passant_tile - 9], self.en_passant_tile - 9, self.en_passant_tile, dir_dict[-9], 1)
+                if file > 0 and self.board[self.en_passant_tile - 9] == Piece.black|Piece.pawn:
+                    en_passant_move = Move(self.board[self.en_passant_tile - 9], self.en_passant_tile - 9, self.en_passant_tile, dir_dict[9], 1)
                     moves.append(en_passant_move)
         #Taking care of castling moves
-        if self.K == True and self.board[61] == None and self.board[62] == None \
-            and self.is_legal_move(Piece.white|Piece.king, 60, 61):
-            castle_move = Move(Piece.king|Piece.white, 60, 62, 2, 2)
-            moves.append(castle_move)
-        if self.Q == True and self.board[57] == None and self.board[58] == None and self.board[59] == None \
-            and self.is_legal_move(Piece.white|Piece.king, 60, 59) and self.is_legal_move(Piece.white|Piece.king, 60, 58):
-            castle_move = Move(Piece.king|Piece.white, 60, 57, 6, 3)
-            moves.append(castle_move)
-        if self.k == True and self.board[5] == None and self.board[6] == None \
-            and self.is_legal_move(Piece.black|Piece.king, 4, 5):
-            castle_move = Move(Piece.king|Piece.black, 4, 6, 6, 2)
-            moves.append(castle_move)
-        if self.q == True and self.board[1] == None and self.board[2] == None and self.board[3] == None \
-            and self.is_legal_move(Piece.black|Piece.king, 4, 3) and self.is_legal_move(Piece.white|Piece.king, 4, 2):
-            castle_move = Move(Piece.king|Piece.black, 4, 1, 2, 3)
-            moves.append(castle_move)
+        if include_castling:
+            moves.extend(self.castling_moves())
+        return moves
+
+    #Computing castling moves, the king may not castle out of, through or into check
+    def castling_moves(self):
+        moves = []
+        if self.color_to_move == Piece.white:
+            if self.castling & 1 and self.board[61] == Piece.none and self.board[62] == Piece.none \
+                and not any(self.is_square_attacked(tile, Piece.black) for tile in (60, 61, 62)):
+                castle_move = Move(Piece.king|Piece.white, 60, 62, 2, 2)
+                moves.append(castle_move)
+            if self.castling & 2 and self.board[57] == Piece.none and self.board[58] == Piece.none and self.board[59] == Piece.none \
+                and not any(self.is_square_attacked(tile, Piece.black) for tile in (60, 59, 58)):
+                castle_move = Move(Piece.king|Piece.white, 60, 58, 6, 2)
+                moves.append(castle_move)
+        else:
+            if self.castling & 4 and self.board[5] == Piece.none and self.board[6] == Piece.none \
+                and not any(self.is_square_attacked(tile, Piece.white) for tile in (4, 5, 6)):
+                castle_move = Move(Piece.king|Piece.black, 4, 6, 2, 2)
+                moves.append(castle_move)
+            if self.castling & 8 and self.board[1] == Piece.none and self.board[2] == Piece.none and self.board[3] == Piece.none \
+                and not any(self.is_square_attacked(tile, Piece.white) for tile in (4, 3, 2)):
+                castle_move = Move(Piece.king|Piece.black, 4, 2, 6, 2)
+                moves.append(castle_move)
         return moves
     
-    #Getting list of all legal moves for current game
+    #Getting list of all legal moves for current game, generated once per position and kept until a move is made
+    #The returned list is shared with the cache and must not be modified
     def get_legal_moves(self):
-        possible_moves = self.compute_moves()
-        legal_moves = self.prune_possible_moves(possible_moves)
+        if self.legal_entry == None:
+            table = self.legal_move_table
+            if table != None:
+                self.legal_entry = table.get(self.hash)
+            if self.legal_entry == None:
+                self.legal_entry = [self.generate_legal_moves(), None]
+                if table != None:
+                    table.put(self.hash, self.legal_entry)
+        return self.legal_entry[0]
+
+    #Generating the list of all legal moves for current game
+    #Checkers, pins and attacked tiles are found once, after which each possible move is accepted or rejected without playing it
+    def generate_legal_moves(self):
+        color = self.color_to_move
+        if color|Piece.king not in self.board:
+            return self.prune_possible_moves(self.compute_moves())
+        king_tile = self.board.index(color|Piece.king)
+        checkers, check_tiles, pins = self.checks_and_pins(color)
+        attacked = self.attacked_tiles(color^24, king_tile)
+        legal_moves = []
+        for move in self.compute_moves(include_castling=False):
+            if move.start_tile == king_tile:
+                if not attacked[move.end_tile]:
+                    legal_moves.append(move)
+            #Only the king can answer a double check
+            elif len(checkers) > 1:
+                continue
+            #En passant removes two pieces from a rank, which can uncover a check no pin covers, so it is played out
+            elif move.end_tile == self.en_passant_tile and move.piece - color == Piece.pawn and move.end_tile % 8 != move.start_tile % 8:
+                if self.is_legal_move(move.piece, move.start_tile, move.end_tile):
+                    legal_moves.append(move)
+            elif move.start_tile in pins and move.end_tile not in pins[move.start_tile]:
+                continue
+            elif checkers and move.end_tile not in check_tiles:
+                continue
+            else:
+                legal_moves.append(move)
+        if not checkers:
+            legal_moves.extend(self.castling_moves())
         return legal_moves
     
-    #Executing a specific move
+    #Executing a specific move and recording it in the game history
     def execute_move(self, move):
-        #Updating game history
-        self.history.pop()
-        self.history.insert(0,self.board)
+        legal_moves = self.make_move(move)
+        #Adding encoding after move execution to the list of encoded game states
+        self.encoding_history.append(self.encode_input())
+        #Adding executed move to executed moves list
+        self.executed_moves.append(self.undo_stack[-1].move)
+
+        return legal_moves
+
+    #Playing a move on the current position, pushing what is needed to take it back onto the undo stack
+    #The game status is only recomputed when update_status is set, legality tests skip it
+    def make_move(self, move, update_status = True):
         #Checking if move is 3-tuple or move class object
         if isinstance(move, int):
             move = self.convert_move(move)
-        #Taking care of en passant moves
-        if (move.piece - self.color_to_move == 1) and (abs(move.end_tile - move.start_tile) ==  9 \
-        or abs(move.end_tile - move.start_tile) ==  7) and self.board[move.end_tile] == None:
-            self.board[move.end_tile] = piece
-            if self.color_to_move == 16:
-                self.board[move.end_tile - 8] = None
-            else:
-                self.board[move.end_tile + 8] = None
+        #Taking care of en passant moves, the captured pawn is not on the end tile
+        captured, captured_tile = self.board[move.end_tile], move.end_tile
+        en_passant = (move.piece - self.color_to_move == 1) and (abs(move.end_tile - move.start_tile) ==  9 \
+        or abs(move.end_tile - move.start_tile) ==  7) and captured == Piece.none
+        if en_passant:
+            if self.color_to_move == 16: captured_tile = move.end_tile - 8
+            else: captured_tile = move.end_tile + 8
+            captured = self.board[captured_tile]
+        #The new board takes the slot of the oldest one, which is kept for unmake_move
+        previous_head = self.planes_head
+        self.planes_head = (previous_head - 1) % history_length
+        self.undo_stack.append(Undo(move, captured, captured_tile, self.castling,
+            self.en_passant_tile, self.half_move_count, self.status, self.board_planes[self.planes_head].copy(),
+            self.legal_entry))
+        self.legal_entry = None
+        #Starting from the previous board's planes, set_tile then only touches the squares the move changes
+        self.board_planes[self.planes_head] = self.board_planes[previous_head]
+
+        if en_passant:
+            self.set_tile(move.end_tile, move.piece)
+            self.set_tile(move.start_tile, Piece.none)
+            self.set_tile(captured_tile, Piece.none)
         #Taking care of castle moves
-        elif move.piece == Piece.white|Piece.king and move.start_tile == 60 and move.end_tile == 62:
-            self.board[62] = Piece.white|Piece.king
-            self.board[61] = Piece.white|Piece.rook
-            self.board[63] = None
-        elif move.piece == Piece.white|Piece.king and move.start_tile == 60 and move.end_tile == 57:
-            self.board[57] = Piece.white|Piece.king
-            self.board[58] = Piece.white|Piece.rook
-            self.board[56] = None
-        elif move.piece == Piece.black|Piece.king and move.start_tile == 4 and move.end_tile == 1:
-            self.board[1] = Piece.black|Piece.king
-            self.board[2] = Piece.black|Piece.rook
-            self.board[0] = None
-        elif move.piece == Piece.black|Piece.king and move.start_tile == 4 and move.end_tile == 6:
-            self.board[6] = Piece.black|Piece.king
-            self.board[5] = Piece.black|Piece.rook
-            self.board[7] = None
+        elif move.piece - self.color_to_move == Piece.king and (move.start_tile, move.end_tile) in castle_rooks:
+            rook_start, rook_end = castle_rooks[(move.start_tile, move.end_tile)]
+            self.set_tile(move.end_tile, move.piece)
+            self.set_tile(rook_end, self.color_to_move|Piece.rook)
+            self.set_tile(move.start_tile, Piece.none)
+            self.set_tile(rook_start, Piece.none)
         #Taking care of pawn promotion moves
         elif move.promotion != None:
             if move.promotion == 2: promotion_type = Piece.queen
-            else: prmotion_type = Piece.knight
-            self.board[move.end_tile] = self.color_to_move|promotion_type
-            self.board[move.start_tile] = None
+            else: promotion_type = Piece.knight
+            self.set_tile(move.end_tile, self.color_to_move|promotion_type)
+            self.set_tile(move.start_tile, Piece.none)
         #Taking care of all other moves
         else:
-            self.board[move.end_tile] = move.piece
-            self.board[move.start_tile] = None
+            self.set_tile(move.end_tile, move.piece)
+            self.set_tile(move.start_tile, Piece.none)
 
 
-        #Updating half move count
-        if (move.piece  - self.color_to_move != Piece.pawn):
+        #Updating half move count, pawn moves and captures reset it
+        if (move.piece  - self.color_to_move != Piece.pawn) and captured == Piece.none:
             self.half_move_count += 0.5
         else:
             self.half_move_count = 0
@@ -375,22 +627,31 @@ class Game(object):
         self.full_move_count+=1
         
         #Updating en passant tile
+        if self.en_passant_tile != None: self.hash ^= zobrist_en_passant[self.en_passant_tile]
         if (move.piece - self.color_to_move == Piece.pawn) and (abs(move.end_tile - move.start_tile) == 16):
             if self.color_to_move == Piece.white: self.en_passant_tile = move.end_tile + 8
             else: self.en_passant_tile = move.end_tile - 8    
         else:
             self.en_passant_tile = None
+        if self.en_passant_tile != None: self.hash ^= zobrist_en_passant[self.en_passant_tile]
         
         #Updating flags for potential castles
-        if self.board[60] != Piece.white|Piece.king: self.K, self.Q = False, False
-        if self.board[63] != Piece.white|Piece.rook: self.K = False
-        if self.board[56] != Piece.white|Piece.rook: self.Q = False
-        if self.board[4] != Piece.black|Piece.king: self.k, self.q = False, False
-        if self.board[7] != Piece.black|Piece.rook: self.k = False
-        if self.board[0] != Piece.black|Piece.rook: self.q = False
+        if self.castling:
+            self.hash ^= zobrist_castling[self.castling]
+            if self.board[60] != Piece.white|Piece.king: self.castling &= ~3
+            if self.board[63] != Piece.white|Piece.rook: self.castling &= ~1
+            if self.board[56] != Piece.white|Piece.rook: self.castling &= ~2
+            if self.board[4] != Piece.black|Piece.king: self.castling &= ~12
+            if self.board[7] != Piece.black|Piece.rook: self.castling &= ~4
+            if self.board[0] != Piece.black|Piece.rook: self.castling &= ~8
+            self.hash ^= zobrist_castling[self.castling]
 
         #Updating color to move 
         self.color_to_move = self.color_to_move^24
+        self.hash ^= zobrist_black_to_move
+        self.hash_history.append(self.hash)
+        if not update_status:
+            return None
         #Recalculating legal moves for opponent to check win conditions
         legal_moves = self.get_legal_moves()
 
@@ -403,64 +664,76 @@ class Game(object):
         elif self.half_move_count >= 50:
             self.status = 0
 
-        #Adding encoding after move execution to the list of encoded game states
-        self.encoding_history.append(self.encode_input())
-        #Adding executed move to executed moves list
-        self.executed_moves.append(move)
-
         return legal_moves
+
+    #Taking back the last move played with make_move, restoring the position exactly as it was
+    def unmake_move(self):
+        undo = self.undo_stack.pop()
+        move = undo.move
+        self.color_to_move = self.color_to_move^24
+        self.full_move_count-=1
+        self.castling, self.legal_entry = undo.castling, undo.legal_entry
+        self.en_passant_tile, self.half_move_count, self.status = undo.en_passant_tile, undo.half_move_count, undo.status
+
+        self.set_tile(move.end_tile, Piece.none)
+        self.set_tile(move.start_tile, move.piece)
+        if undo.captured != Piece.none:
+            self.set_tile(undo.captured_tile, undo.captured)
+        elif move.piece - self.color_to_move == Piece.king and (move.start_tile, move.end_tile) in castle_rooks:
+            rook_start, rook_end = castle_rooks[(move.start_tile, move.end_tile)]
+            self.set_tile(rook_end, Piece.none)
+            self.set_tile(rook_start, self.color_to_move|Piece.rook)
+
+        #The planes of the taken back board are dropped, restoring the evicted oldest board behind the current one
+        self.board_planes[self.planes_head] = undo.evicted_planes
+        self.planes_head = (self.planes_head + 1) % history_length
+        #The pieces put back above changed the hash as well, the stored hash of the previous position is exact
+        self.hash_history.pop()
+        self.hash = self.hash_history[-1]
+        return move
         
 
-    #Encoding input for Network
-    def encode_input(self):
-        input = []
-        history = copy.deepcopy(self.history)
-        history.insert(0, self.board)
-        rank = []
-        for i in range(8):
-            file = []
-            for j in range(8):
-                features = []
-                for board in history:
-                    if board != None:
-                        tile = (i * 8) + j
-                        tile_enc = encode_tile(board, tile)
-                        for val in tile_enc:
-                            features.append(val)
-                    else:
-                        for x in range(12):
-                            features.append(0)
-                state_enc = encode_game_state(self)
-                for val in state_enc:
-                    features.append(val)
+    #Encoding input for Network, a (1, 8, 8, 103) array holding 12 piece planes for each of the last 8 boards
+    #followed by the game state, written into out when a preallocated array is given
+    def encode_input(self, out = None):
+        if out is None:
+            out = numpy.empty((1, 8, 8, 12 * history_length + 7), dtype = numpy.float32)
+        order = (self.planes_head + history_order) % history_length
+        out[0, :, :, :12 * history_length] = self.board_planes[order].transpose(1, 2, 0, 3).reshape(8, 8, 12 * history_length)
+        out[0, :, :, 12 * history_length:] = encode_game_state(self)
+        return out
 
-                file.append(features)
-            rank.append(file)
-        input.append(rank)
-        return input
+    #Key identifying what encode_input produces: the hashes of the boards in the history planes and the move counts
+    def input_key(self):
+        return (tuple(self.hash_history[-history_length:]), self.full_move_count, self.half_move_count)
 
     #Obtaining the index position of legal moves from the constant list of all possible moves
     def get_legal_indexes(self):
         legal_moves = self.get_legal_moves()
-        indexes = legal_indexes(self.all_moves, legal_moves)
-        return indexes
-
-
-    #Updating list of node visits within specific game
-    def update_stats(self, root):
-        sum_visits = sum(child.visit_count for child in root.children.values())
-        self.node_visits.append([
-            root.children[move_index].visit_count / sum_visits if move_index in root.children else 0
-            for move_index in range(4864)
-    ])
+        if self.legal_entry[1] == None:
+            self.legal_entry[1] = legal_indexes(legal_moves)
+        return self.legal_entry[1]
+
+
+    #Updating list of node visits within specific game from the root moves and their visit counts, kept sparse as
+    #the (move indexes, probabilities) of the moves the search visited
+    def update_stats(self, moves, visit_counts):
+        moves = numpy.asarray(moves, dtype=numpy.uint16)
+        visit_counts = numpy.asarray(visit_counts, dtype=numpy.uint32)
+        #A forced move is played without visiting it
+        total = visit_counts.sum()
+        if total:
+            visited = visit_counts > 0
+            self.node_visits.append((moves[visited], (visit_counts[visited] / total).astype(numpy.float32)))
+        else:
+            self.node_visits.append((moves, numpy.full(len(moves), 1 / len(moves), dtype=numpy.float32)))
+        self.root_visits.append((moves, visit_counts))
 
 
     #Converting (start_tile, end_tile, promotion) action into Move object
     def convert_move(self, move_index):
-        move = self.all_moves[move_index]
-        start_tile, end_tile, dir, dis, promotion = move
+        start_tile, end_tile, dir, dis, promotion = all_moves[move_index]
         piece = self.color_to_move|self.board[start_tile]
-        Move(piece, start_tile, end_tile, dir, dis, promotion)
         #offset = end_tile - start_tile
         #if offset in knight_offsets:
         #    dir, dis = knight_dict[offset], 1
@@ -470,45 +743,10 @@ class Game(object):
         converted_move = Move(piece, start_tile, end_tile, dir, dis, promotion)
         return converted_move
 
-    def make_image(self, move_number):
-        return self.encoding_history[move_number]
-
-    def make_target(self, move_number):
-        if self.status == None: status = 0
-        else: status = self.status
-        return status, self.node_visits[move_number]
-
-
-#Hot encoding features specific to a tile on a given board
-def encode_tile(board, tile):
-    white_pawn, white_rook, white_knight, white_bishop, white_queen, white_king = 0,0,0,0,0,0
-    black_pawn, black_rook, black_knight, black_bishop, black_queen, black_king = 0,0,0,0,0,0
-    piece = board[tile]
-    if piece != None:
-        if piece < 16: color = 8
-        else: color = 16
-        value = piece - color
-        if value == Piece.pawn:
-            if color == Piece.white: white_pawn = 1
-            else: black_pawn = 1
-        elif value == Piece.rook:
-            if color == Piece.white: white_rook = 1
-            else: black_rook = 1
-        elif value == Piece.knight:
-            if color == Piece.white: white_knight = 1
-            else: black_knight = 1
-        elif value == Piece.bishop:
-            if color == Piece.white: white_bishop = 1
-            else: black_bishop = 1
-        elif value == Piece.queen:
-            if color == Piece.white: white_queen = 1
-            else: black_queen = 1
-        elif value == Piece.king:
-            if color == Piece.white: white_king = 1
-            else: black_king = 1
-    
-    return (white_pawn, white_rook, white_knight, white_bishop, white_queen, white_king,
-    black_pawn, black_rook, black_knight, black_bishop, black_queen, black_king)
+
+#Takes in chess square (ie e3) and returns tile number 
+def chess_square_to_tile(square):
+    return (8 - int(square[1])) * 8 + 'abcdefgh'.index(square[0])
 
 
 #Hot encoding the current game state
@@ -529,35 +767,6 @@ def encode_game_state(game):
     full_move_count, half_move_count, color_to_move)
 
 
-#Helper function to get constant list of all possible
-def get_all_moves():
-    all_moves = []
-    for start_tile in range(64):
-        for dir in range(8):
-            for dis in range(1,8):
-                offset = direction_offsets[dir]
-                end_tile = start_tile + (offset * dis)
-                all_moves.append((start_tile, end_tile, dir, dis, None))
-        for offset in knight_offsets:
-            end_tile = start_tile + offset
-            all_moves.append((start_tile, end_tile, knight_dict[offset], 1, None))
-        for dir in (0,1,3,4,5,7):
-            for promotion in (1,2):
-                end_tile = start_tile + direction_offsets[dir]
-                all_moves.append((start_tile, end_tile, dir, 1, promotion))
-    return all_moves
-
-
 #Helper function to get list of indexes for legal move position in list of all possible moves
-def legal_indexes(all_moves, legal_moves):
-    indexes = []
-    for legal in legal_moves:
-        for i in [i for i, all in enumerate(all_moves) if all == ((legal.start_tile, legal.end_tile, legal.direction,legal.distance, legal.promotion))]:
-            indexes.append(i)
-    return indexes
-
-
-
-
-
-
+def legal_indexes(legal_moves):
+    return [move.index() for move in legal_moves]
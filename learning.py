@@ -1,7 +1,8 @@
 import tensorflow as tf
 from tensorflow import keras
-from game import Game
-import math, numpy, copy, time
+from game import Game, LegalMoveTable
+from bitboard import BitboardGame
+import math, numpy, time, collections, multiprocessing, queue, signal, os, threading, concurrent.futures, traceback
 
 
 
@@ -9,7 +10,17 @@ class Config():
     total_move_number = 4864
     max_moves = 50
     #num_sample_moves = 30
+    #Simulations per search and seconds per search, either can be None to leave the search limited by the other
     num_simulations = 100
+    search_time_limit = None
+    #Stopping a search once the most visited move can no longer be overtaken within its limits
+    early_stopping = True
+    #Leaves collected per round of simulations and evaluated in one forward pass, 1 evaluates every leaf on its own
+    search_batch_size = 8
+    #Visits added to every node on a pending path so the other paths of the round avoid it until its leaf is evaluated
+    virtual_loss = 1
+    #Generating moves with bitboards (BitboardGame) instead of the board list (Game)
+    bitboard_engine = True
 
     # Root prior exploration noise.
     root_dirichlet_alpha = 0.3  
@@ -18,9 +29,53 @@ class Config():
     pb_c_base = 19652
     pb_c_init = 1.25
 
+    #Positions reached through different move orders share one node, keyed by the game hash
+    transposition_table_size = 100000
+    #Entry dropped when the table is full: 'lru' (least recently used), 'fifo' (oldest stored)
+    #or 'visits' (least visited among the oldest transposition_replacement_window entries)
+    transposition_replacement = 'lru'
+    transposition_replacement_window = 8
+    #Positions whose legal moves are kept across games (0 disables it), moves are cached per position regardless
+    legal_move_cache_size = 20000
+    #Megabytes of network outputs kept per network by position, 0 disables the evaluation cache
+    evaluation_cache_megabytes = 64
+    #Processes playing games in self_play, None uses one per core
+    self_play_workers = None
+    #Seconds self_play waits for workers to finish their current game after being interrupted or after a worker failed
+    shutdown_timeout = 60
+    #Seconds between the checks for worker or inference server processes which died without reporting back
+    worker_poll_interval = 1
+    #Evaluating the positions of every self_play worker in one process holding the only model
+    inference_server = False
+    #Positions evaluated together at most, and seconds the server waits for more requests to fill a batch
+    inference_max_batch = 64
+    inference_max_wait = 0.002
+    #Seconds between the metrics the server prints, 0 only prints them when asked
+    inference_report_interval = 30
+    #Evaluating through a traced tf.function instead of model.predict, which sets up a data pipeline every call
+    compiled_inference = True
+    #Threads TensorFlow uses within and across operations, 0 leaves its default
+    intra_op_threads = 0
+    inter_op_threads = 0
+    #Threads searching one position in parallel_mcts and root_parallel_mcts
+    search_threads = 4
+    #Keeping the subtree under the executed move as the root of the next search
+    reuse_tree = True
+    #True shares one tree between both colors so every search continues the previous one, False keeps one tree
+    #per color which is reused two plies down, after its own move and the opponent's reply
+    reuse_opponent_tree = True
+
     training_steps = 10
     checkpoint_interval = 2
+    #Training steps between the losses and steps/second train prints
+    training_log_interval = 1
+    #Games and positions kept for training, a position takes about 1.1 kB
     window_size = 1000
+    window_positions = 500000
+    #Most visited moves kept per position in the visit distribution targets
+    policy_target_moves = 64
+    #Sampling weight of a game relative to the one saved after it, 1 samples every stored position alike
+    sample_recency = 1.0
     batch_size = 50
 
     weight_decay = 1e-4
@@ -35,224 +90,1129 @@ class Config():
     }
 
 
+#Settings of Config as a dict, for spawned processes which import this module afresh and would miss the ones
+#changed at runtime
+def config_values():
+    return {name: value for name, value in vars(Config).items() if not name.startswith('_')}
+
+
+#Applying settings from config_values in a spawned process
+def load_config(values):
+    for name, value in values.items():
+        setattr(Config, name, value)
+
+
 class Network(object):
     def __init__(self):
+        #Thread counts can only be set before TensorFlow starts its runtime, which loading the model does
+        try:
+            tf.config.threading.set_intra_op_parallelism_threads(Config.intra_op_threads)
+            tf.config.threading.set_inter_op_parallelism_threads(Config.inter_op_threads)
+        except RuntimeError:
+            pass
         self.model = keras.models.load_model(".\model")
+        self.infer = None
+        if Config.compiled_inference:
+            #One trace serves every batch size, running it once here keeps the tracing out of the first search
+            self.infer = tf.function(lambda inputs: self.model(inputs, training=False),
+                input_signature=[tf.TensorSpec((None, 8, 8, 103), tf.float32)])
+            self.infer(numpy.zeros((1, 8, 8, 103), dtype=numpy.float32))
+        self.evaluation_cache = EvaluationCache() if Config.evaluation_cache_megabytes else None
+        self.optimizer, self.compiled_train_step = None, None
 
     def save(self):
         self.model.save('.\model')
 
     def predict(self, input):
-        output = network.model.predict(input)
+        if self.infer != None:
+            policy_outputs, values = self.predict_batch(input)
+            return policy_outputs[0], values[0]
+        output = self.model.predict(input)
         policy_output, value_output = output[0][0], output[1][0][0]
         return policy_output, value_output
 
+    #Evaluating a (batch, 8, 8, 103) array of inputs in one forward pass, returning the policies and values of every row
+    def predict_batch(self, inputs):
+        if self.infer != None:
+            policy_output, value_output = self.infer(numpy.asarray(inputs, dtype=numpy.float32))
+            return policy_output.numpy(), value_output.numpy()[:, 0]
+        policy_output, value_output = self.model.predict(inputs, verbose=0)
+        return policy_output, value_output[:, 0]
+
     def get_weights(self):
         return self.model.get_weights()
 
+    #Updating the weights on one batch, returning its value, policy and weight decay losses
+    #The optimizer is kept across calls so its momentum and step count, which drives the learning rate schedule, persist
+    #The visit distribution targets come as the (batch, moves) arrays of moves and probabilities Storage keeps
+    def train_step(self, images, target_values, target_moves, target_probs):
+        if self.compiled_train_step == None:
+            steps = sorted(Config.learning_rate_schedule)
+            schedule = tf.keras.optimizers.schedules.PiecewiseConstantDecay(
+                [int(step) for step in steps[1:]], [Config.learning_rate_schedule[step] for step in steps])
+            self.optimizer = tf.keras.optimizers.SGD(schedule, Config.momentum, nesterov=False, name='SGD')
+            self.compiled_train_step = tf.function(self.batch_step, input_signature=[
+                tf.TensorSpec((None, 8, 8, 103), tf.float32),
+                tf.TensorSpec((None,), tf.float32),
+                tf.TensorSpec((None, None), tf.int32),
+                tf.TensorSpec((None, None), tf.float32)])
+        value_loss, policy_loss, l2_loss = self.compiled_train_step(images, target_values, target_moves, target_probs)
+        return float(value_loss), float(policy_loss), float(l2_loss)
 
-class Node(object):
-    def __init__(self, prior):
-        self.prior = prior
-        self.visit_count = 0
-        self.value_sum = 0
-        self.children = {}
-        self.child_visits = []
-        self.color_to_move = None
-    
-    def value(self):
-        if self.visit_count == 0:
+    def batch_step(self, images, target_values, target_moves, target_probs):
+        #Scattering the sparse targets into dense ones, the padding adds probability 0
+        rows = tf.broadcast_to(tf.range(tf.shape(target_moves)[0])[:, None], tf.shape(target_moves))
+        target_policies = tf.scatter_nd(tf.stack([rows, target_moves], axis=-1), target_probs,
+            [tf.shape(target_moves)[0], Config.total_move_number])
+        with tf.GradientTape() as tape:
+            policy_outputs, values = self.model(images, training=True)
+            value_loss = tf.reduce_mean(tf.square(values[:, 0] - target_values))
+            policy_loss = tf.reduce_mean(tf.nn.softmax_cross_entropy_with_logits(labels=target_policies, logits=policy_outputs))
+            l2_loss = Config.weight_decay * tf.add_n([tf.nn.l2_loss(weights) for weights in self.model.trainable_variables])
+            loss = value_loss + policy_loss + l2_loss
+        gradients = tape.gradient(loss, self.model.trainable_variables)
+        self.optimizer.apply_gradients(zip(gradients, self.model.trainable_variables))
+        return value_loss, policy_loss, l2_loss
+
+
+#Owning the model in its own process and evaluating the positions sent by many clients in shared batches
+#Requests are ('predict', client_id, sent_time, inputs), ('metrics',) or None to stop
+class InferenceServer(object):
+    def __init__(self, num_clients):
+        context = multiprocessing.get_context('spawn')
+        self.requests, self.reports = context.Queue(), context.Queue()
+        self.responses = [context.Queue() for _ in range(num_clients)]
+        #Set once the server stops answering, by the server as it exits or by check when it died without exiting
+        self.down = context.Event()
+        self.process = context.Process(target=serve_inference, args=(config_values(), self.requests, self.responses, self.reports, self.down))
+
+    def start(self):
+        self.process.start()
+
+    #Whether the server is still running, letting its clients know when it is not
+    def check(self):
+        if not self.process.is_alive():
+            self.down.set()
+        return not self.down.is_set()
+
+    #Client for one search loop, to be used in place of a Network
+    def client(self, client_id):
+        return InferenceClient(client_id, self.requests, self.responses[client_id], self.down)
+
+    #Queue depth, batch size histogram and latency summary so far
+    def metrics(self):
+        self.requests.put(('metrics',))
+        while True:
+            try:
+                return self.reports.get(timeout=Config.worker_poll_interval)
+            except queue.Empty:
+                if not self.check():
+                    raise RuntimeError('Inference server stopped')
+
+    def stop(self):
+        self.requests.put(None)
+        self.process.join()
+
+
+class InferenceClient(object):
+    def __init__(self, client_id, requests, responses, down):
+        self.client_id = client_id
+        self.requests = requests
+        self.responses = responses
+        self.down = down
+        self.evaluation_cache = EvaluationCache() if Config.evaluation_cache_megabytes else None
+
+    def predict(self, input):
+        policy_outputs, values = self.predict_batch(input)
+        return policy_outputs[0], values[0]
+
+    def predict_batch(self, inputs):
+        self.requests.put(('predict', self.client_id, time.time(), numpy.ascontiguousarray(inputs)))
+        #Waiting in steps so a server which stopped answering fails the search instead of blocking it forever
+        while True:
+            try:
+                return self.responses.get(timeout=Config.worker_poll_interval)
+            except queue.Empty:
+                if self.down.is_set():
+                    raise RuntimeError('Inference server stopped')
+
+
+#Bounded map from Game.input_key() to (logits of the legal moves, value) the network gave for that input,
+#least recently used entries are dropped once the entries take up megabytes
+#Entries are only valid for the weights they were computed with, train clears the cache of the network it updates
+class EvaluationCache(object):
+    #Approximate bytes taken by an entry besides its logits
+    entry_overhead = 400
+
+    def __init__(self, megabytes=None):
+        self.capacity = (megabytes if megabytes != None else Config.evaluation_cache_megabytes) * 2**20
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.hits, self.misses = 0, 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry == None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, legal_logits, value):
+        if key in self.entries:
+            return
+        self.entries[key] = (legal_logits, value)
+        self.size += legal_logits.nbytes + self.entry_overhead
+        while self.size > self.capacity:
+            _, (evicted_logits, _) = self.entries.popitem(last=False)
+            self.size -= evicted_logits.nbytes + self.entry_overhead
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0
+
+    def __len__(self):
+        return len(self.entries)
+
+
+#Batch sizes, queue depths and request latencies seen by the inference server
+class InferenceMetrics(object):
+    def __init__(self, window=10000):
+        self.batch_sizes = collections.Counter()
+        self.queue_depths = collections.deque(maxlen=window)
+        self.latencies = collections.deque(maxlen=window)
+        self.requests, self.positions = 0, 0
+
+    def summary(self):
+        batches = sum(self.batch_sizes.values())
+        latencies = numpy.array(self.latencies) * 1000
+        depths = numpy.array(self.queue_depths)
+        return {
+            'requests': self.requests,
+            'positions': self.positions,
+            'batches': batches,
+            'mean_batch_size': self.positions / batches if batches else 0,
+            'batch_size_histogram': dict(sorted(self.batch_sizes.items())),
+            'mean_queue_depth': float(depths.mean()) if len(depths) else 0,
+            'max_queue_depth': int(depths.max()) if len(depths) else 0,
+            'latency_ms': {q: float(numpy.percentile(latencies, q)) if len(latencies) else 0 for q in (50, 90, 99)}}
+
+
+#Process of InferenceServer, answering requests until it is sent None and setting down however it ends
+def serve_inference(config, requests, responses, reports, down):
+    try:
+        answer_requests(config, requests, responses, reports)
+    finally:
+        down.set()
+
+
+def answer_requests(config, requests, responses, reports):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    load_config(config)
+    network = Network()
+    metrics = InferenceMetrics()
+    last_report = time.perf_counter()
+    #Request which ended the gathering of the previous batch without being part of it
+    pending = []
+    while True:
+        request = pending.pop() if pending else requests.get()
+        if request == None:
+            break
+        if request[0] == 'metrics':
+            reports.put(metrics.summary())
+            continue
+        batch, positions = gather_batch(requests, request, pending, Config.inference_max_batch, Config.inference_max_wait,
+            lambda request: request[3] if request[0] == 'predict' else None)
+        try:
+            metrics.queue_depths.append(requests.qsize())
+        except NotImplementedError:
+            pass
+
+        policy_outputs, values = network.predict_batch(numpy.concatenate([inputs for _, _, _, inputs in batch]))
+        start = 0
+        for _, client_id, sent_time, inputs in batch:
+            end = start + len(inputs)
+            responses[client_id].put((policy_outputs[start:end], values[start:end]))
+            metrics.latencies.append(time.time() - sent_time)
+            start = end
+        metrics.batch_sizes[positions] += 1
+        metrics.requests += len(batch)
+        metrics.positions += positions
+
+        if Config.inference_report_interval and time.perf_counter() - last_report > Config.inference_report_interval:
+            print('Inference server: ' + str(metrics.summary()))
+            last_report = time.perf_counter()
+
+
+#Requests taken from requests to join first in one batch, until it holds max_batch positions or first has waited
+#max_wait seconds, together with its number of positions. inputs_of gives the inputs of a request, None when the
+#request cannot be batched, such a request (or a None request) ends the batch and is left in pending
+def gather_batch(requests, first, pending, max_batch, max_wait, inputs_of):
+    batch = [first]
+    positions = len(inputs_of(first))
+    deadline = time.perf_counter() + max_wait
+    while positions < max_batch:
+        try:
+            request = requests.get(timeout=max(0, deadline - time.perf_counter()))
+        except queue.Empty:
+            break
+        inputs = inputs_of(request) if request != None else None
+        if inputs is None:
+            pending.append(request)
+            break
+        batch.append(request)
+        positions += len(inputs)
+    return batch, positions
+
+
+#Search tree kept as a pool of nodes in flat arrays indexed by node number, the children of an expanded node
+#are the contiguous edges first_edge[node] to first_edge[node] + num_edges[node], each with its move, prior and child node
+#A child of an edge can be replaced by the node of the same position reached through another move order, the node's
+#visits and values are then shared while every parent keeps the prior its own policy gave the move
+class Tree(object):
+    def __init__(self, capacity=1024):
+        self.node_count, self.edge_count = 0, 0
+        self.visit_count = numpy.zeros(capacity, dtype=numpy.int32)
+        self.value_sum = numpy.zeros(capacity)
+        #Piece.white or Piece.black once the node is expanded, 0 before
+        self.color_to_move = numpy.zeros(capacity, dtype=numpy.int8)
+        self.first_edge = numpy.zeros(capacity, dtype=numpy.int32)
+        self.num_edges = numpy.zeros(capacity, dtype=numpy.int32)
+        self.edge_move = numpy.zeros(capacity, dtype=numpy.int32)
+        self.edge_prior = numpy.zeros(capacity)
+        self.edge_child = numpy.zeros(capacity, dtype=numpy.int32)
+        self.root = int(self.add_nodes(1)[0])
+
+    #Adding count unexpanded nodes, returning their numbers
+    def add_nodes(self, count):
+        start, end = self.node_count, self.node_count + count
+        if end > len(self.visit_count):
+            for name in ('visit_count', 'value_sum', 'color_to_move', 'first_edge', 'num_edges'):
+                setattr(self, name, grow(getattr(self, name), end))
+        self.node_count = end
+        return numpy.arange(start, end, dtype=numpy.int32)
+
+    #Giving node one child per move with the given priors
+    def add_children(self, node, moves, priors):
+        start, end = self.edge_count, self.edge_count + len(moves)
+        if end > len(self.edge_move):
+            for name in ('edge_move', 'edge_prior', 'edge_child'):
+                setattr(self, name, grow(getattr(self, name), end))
+        self.edge_move[start:end] = moves
+        self.edge_prior[start:end] = priors
+        self.edge_child[start:end] = self.add_nodes(len(moves))
+        self.first_edge[node], self.num_edges[node] = start, len(moves)
+        self.edge_count = end
+
+    def expanded(self, node):
+        return self.num_edges[node] != 0
+
+    #Edge numbers of the children of node
+    def edges(self, node):
+        start = self.first_edge[node]
+        return slice(start, start + self.num_edges[node])
+
+    def value(self, node):
+        if self.visit_count[node] == 0:
             return 0
-        return self.value_sum / self.visit_count
-    
-    def expanded(self):
-        return self.children != {}
+        return self.value_sum[node] / self.visit_count[node]
+
+    #Child of node reached through move, None if node has no such child
+    def child(self, node, move):
+        edges = self.edges(node)
+        found = numpy.flatnonzero(self.edge_move[edges] == move)
+        if len(found) == 0:
+            return None
+        return int(self.edge_child[edges.start + found[0]])
+
+    #Boolean mask of the nodes reachable from node
+    def reachable(self, node):
+        mask = numpy.zeros(self.node_count, dtype=bool)
+        mask[node] = True
+        frontier = numpy.array([node], dtype=numpy.int32)
+        while len(frontier):
+            frontier = frontier[self.num_edges[frontier] != 0]
+            if len(frontier) == 0:
+                break
+            children = numpy.concatenate([self.edge_child[self.edges(parent)] for parent in frontier])
+            frontier = numpy.unique(children[~mask[children]])
+            mask[frontier] = True
+        return mask
+
+
+#Copy of array with room for at least size entries, doubling so repeated growth stays cheap
+def grow(array, size):
+    grown = numpy.zeros(max(size, 2 * len(array)), dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+
+#Bounded map from position hash to the number of the search node of that position in tree
+class TranspositionTable(object):
+    def __init__(self, tree, size=None, replacement=None):
+        self.tree = tree
+        self.size = size if size != None else Config.transposition_table_size
+        self.replacement = replacement if replacement != None else Config.transposition_replacement
+        self.entries = collections.OrderedDict()
+        self.hits, self.misses = 0, 0
+
+    def get(self, hash):
+        node = self.entries.get(hash)
+        if node == None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if self.replacement == 'lru':
+            self.entries.move_to_end(hash)
+        return node
+
+    def put(self, hash, node):
+        if hash in self.entries:
+            self.entries[hash] = node
+            if self.replacement == 'lru':
+                self.entries.move_to_end(hash)
+            return
+        if len(self.entries) >= self.size:
+            self.evict()
+        self.entries[hash] = node
+
+    def evict(self):
+        if self.replacement == 'visits':
+            #Looking only at the oldest few entries keeps eviction cheap while still sparing heavily visited nodes
+            oldest = []
+            for hash, node in self.entries.items():
+                oldest.append((self.tree.visit_count[node], hash))
+                if len(oldest) >= Config.transposition_replacement_window:
+                    break
+            del self.entries[min(oldest)[1]]
+        else:
+            self.entries.popitem(last=False)
+
+    #Dropping the entries of nodes outside the given mask of tree nodes
+    def keep(self, mask):
+        self.entries = collections.OrderedDict((hash, node) for hash, node in self.entries.items() if mask[node])
+
+    def __len__(self):
+        return len(self.entries)
 
     
+#Replay buffer of the positions of the last window_size games, at most window_positions of them, kept in
+#preallocated arrays used as a ring: a game's positions are written after the newest ones and whole games are
+#dropped from the oldest end, so saving and evicting cost nothing per position already stored
+#Piece planes are bit packed and visit distributions kept as their policy_target_moves largest (move, probability) pairs
 class Storage(object):
-    def __init__(self):
-        self.buffer = []
+    def __init__(self, window_positions=None, window_size=None, recency=None):
+        self.capacity = window_positions or Config.window_positions
+        self.window_size = window_size or Config.window_size
+        self.recency = recency if recency != None else Config.sample_recency
+        self.planes = numpy.zeros((self.capacity, 8 * 8 * 96 // 8), dtype=numpy.uint8)
+        self.game_state = numpy.zeros((self.capacity, 7), dtype=numpy.float32)
+        self.policy_moves = numpy.zeros((self.capacity, Config.policy_target_moves), dtype=numpy.uint16)
+        self.policy_probs = numpy.zeros((self.capacity, Config.policy_target_moves), dtype=numpy.float16)
+        self.values = numpy.zeros(self.capacity, dtype=numpy.float32)
+        self.game_ids = numpy.zeros(self.capacity, dtype=numpy.int64)
+        #Slot the next position is written to and positions stored
+        self.head, self.count = 0, 0
+        #The stored games, oldest first, are entries game_first to game_last of the game arrays with their first slot,
+        #positions and cumulative sampling weight, the weight of the games dropped before them being cumulative_base
+        #Every position of a game weighs weight_scale at the time it is saved, which grows by 1 / recency per game and
+        #is brought back to 1 by rescale_weights before it leaves the floating point range
+        self.game_slots = numpy.zeros(2 * self.window_size, dtype=numpy.int64)
+        self.game_positions = numpy.zeros(2 * self.window_size, dtype=numpy.int64)
+        self.game_cumulative = numpy.zeros(2 * self.window_size)
+        self.game_first, self.game_last = 0, 0
+        self.cumulative_base, self.weight_scale = 0.0, 1.0
+        self.next_game_id = 0
         self.networks = {}
-        self.batch_size = 1
+        self.batch_size = Config.batch_size
 
+    #Storing the positions of a finished Game or GameRecord, dropping the oldest games to make room
     def save_game(self, game):
-        if len(self.buffer) > Config.window_size:
-            self.buffer.pop(0)
-            self.buffer.append(game)
-        else:
-            self.buffer.append(game)
+        positions = min(len(game.node_visits), self.capacity)
+        if positions == 0:
+            return
+        while self.game_first < self.game_last and (self.count + positions > self.capacity
+                or self.game_last - self.game_first >= self.window_size):
+            self.count -= self.game_positions[self.game_first]
+            self.cumulative_base = self.game_cumulative[self.game_first]
+            self.game_first += 1
+        first = len(game.node_visits) - positions
+        slots = (self.head + numpy.arange(positions)) % self.capacity
+
+        inputs = numpy.concatenate(game.encoding_history[first:first + positions])
+        self.planes[slots] = numpy.packbits(inputs[:, :, :, :96].reshape(positions, -1) != 0, axis=1)
+        self.game_state[slots] = inputs[:, 0, 0, 96:]
+        #Keeping the most visited moves of every position, which are all of them unless a search spread very wide
+        self.policy_moves[slots], self.policy_probs[slots] = 0, 0
+        for slot, (moves, probs) in zip(slots, game.node_visits[first:]):
+            if len(moves) > Config.policy_target_moves:
+                kept = numpy.argpartition(-probs, Config.policy_target_moves - 1)[:Config.policy_target_moves]
+                moves, probs = moves[kept], probs[kept] / probs[kept].sum()
+            self.policy_moves[slot, :len(moves)] = moves
+            self.policy_probs[slot, :len(moves)] = probs
+        self.values[slots] = game.status if game.status != None else 0
+        self.game_ids[slots] = self.next_game_id
+        self.add_game(slots[0], positions)
+        self.next_game_id += 1
+        self.head = (self.head + positions) % self.capacity
+        self.count += positions
 
+    def add_game(self, slot, positions):
+        #Moving the stored games back to the start of the game arrays once they reach the end
+        if self.game_last == len(self.game_slots):
+            live = self.game_last - self.game_first
+            for array in (self.game_slots, self.game_positions, self.game_cumulative):
+                array[:live] = array[self.game_first:self.game_last]
+            self.game_first, self.game_last = 0, live
+            self.rescale_weights()
+        #A recency far from 1 takes weight_scale out of range long before the game arrays fill up
+        elif not 1e-100 < self.weight_scale < 1e100:
+            self.rescale_weights()
+        previous = self.game_cumulative[self.game_last - 1] if self.game_last > self.game_first else self.cumulative_base
+        self.game_slots[self.game_last] = slot
+        self.game_positions[self.game_last] = positions
+        self.game_cumulative[self.game_last] = previous + positions * self.weight_scale
+        self.game_last += 1
+        self.weight_scale /= self.recency
+
+    #Rescaling the weights of the stored games so a new position weighs 1 again, the weights of games far older than
+    #the newest may become 0
+    def rescale_weights(self):
+        games = slice(self.game_first, self.game_last)
+        self.game_cumulative[games] = (self.game_cumulative[games] - self.cumulative_base) / self.weight_scale
+        self.cumulative_base, self.weight_scale = 0.0, 1.0
+
+    #Slots of size positions drawn in one go, each position weighted by its game's weight
+    def sample_slots(self, size):
+        cumulative = self.game_cumulative[self.game_first:self.game_last]
+        draws = self.cumulative_base + numpy.random.random(size) * (cumulative[-1] - self.cumulative_base)
+        games = numpy.minimum(numpy.searchsorted(cumulative, draws, side='right'), len(cumulative) - 1)
+        #Where a draw falls within its game's weight gives the position in the game
+        starts = numpy.concatenate(([self.cumulative_base], cumulative[:-1]))[games]
+        positions = self.game_positions[self.game_first + games]
+        offsets = ((draws - starts) / (cumulative[games] - starts) * positions).astype(numpy.int64)
+        return (self.game_slots[self.game_first + games] + numpy.minimum(offsets, positions - 1)) % self.capacity
+
+    #Network inputs of the positions in slots, as a (len(slots), 8, 8, 103) array
+    def make_images(self, slots):
+        images = numpy.empty((len(slots), 8, 8, 103), dtype=numpy.float32)
+        images[:, :, :, :96] = numpy.unpackbits(self.planes[slots], axis=1).reshape(len(slots), 8, 8, 96)
+        images[:, :, :, 96:] = self.game_state[slots][:, None, None, :]
+        return images
+
+    #Value targets and sparse visit distribution targets of the positions in slots, the visit distribution of a
+    #position being its moves with their probabilities, padded with probability 0
+    def make_targets(self, slots):
+        return self.values[slots], self.policy_moves[slots].astype(numpy.int32), self.policy_probs[slots].astype(numpy.float32)
+
+    #Inputs, value targets, and visit distribution target moves and probabilities of batch_size positions
     def sample_batch(self):
-    # Sample uniformly across positions.
-        move_sum = float(sum(len(game.history) for game in self.buffer))
-        games = numpy.random.choice(
-            self.buffer,
-            size=self.batch_size,
-            p=[len(game.history) / move_sum for game in self.buffer])
-        game_pos = [(game, numpy.random.randint(len(game.history))) for game in games]
-        return [(game.make_image(i), game.make_target(i)) for (game, i) in game_pos]
+        slots = self.sample_slots(self.batch_size)
+        return (self.make_images(slots),) + self.make_targets(slots)
 
     def save_network(self, step, network):
         self.networks[step] = network
-    
+
+    def __len__(self):
+        return self.count
+
+
+#The parts of a finished game Storage samples from, small enough to send between processes
+class GameRecord(object):
+    def __init__(self, game):
+        self.encoding_history = game.encoding_history
+        self.node_visits = game.node_visits
+        self.status = game.status
+        #What records.write_game stores
+        self.start_fen = game.start_fen
+        self.move_indexes = [move.index() for move in game.executed_moves]
+        self.root_visits = game.root_visits
+
+
+#Playing num_games games in worker processes, each with its own network, and saving them to storage as they finish
+#Interrupting waits for the games in progress before returning
+def self_play(storage, num_games, num_workers=None):
+    num_workers = num_workers or Config.self_play_workers or os.cpu_count()
+    #Spawned workers start without the parent's TensorFlow state
+    context = multiprocessing.get_context('spawn')
+    game_counts, results, stop = context.Queue(), context.Queue(), context.Event()
+    for game_count in range(1, num_games + 1):
+        game_counts.put(game_count)
+    server = None
+    if Config.inference_server:
+        server = InferenceServer(num_workers)
+        server.start()
+    workers = [context.Process(target=self_play_worker,
+        args=(worker_id, config_values(), game_counts, results, stop, server.client(worker_id) if server else None))
+        for worker_id in range(num_workers)]
+    for worker in workers:
+        worker.start()
+
+    t0 = time.perf_counter()
+    games, moves = [0] * num_workers, [0] * num_workers
+    #Workers which sent their final message or died, the errors they failed with, and once stopping, when to give up on them
+    done, errors, deadline = [False] * num_workers, [], None
+    while not all(done) and (deadline == None or time.perf_counter() < deadline):
+        try:
+            worker_id, game_count, payload = results.get(timeout=Config.worker_poll_interval)
+        except queue.Empty:
+            #A server which died makes its clients fail, which the workers then report
+            if server:
+                server.check()
+            #Python errors are reported by the workers themselves, a nonzero exit without a report is a hard crash
+            for worker_id, worker in enumerate(workers):
+                if not done[worker_id] and worker.exitcode not in (None, 0):
+                    done[worker_id] = True
+                    errors.append('Worker ' + str(worker_id) + ' exited with code ' + str(worker.exitcode))
+            if errors and deadline == None:
+                stop.set()
+                deadline = time.perf_counter() + Config.shutdown_timeout
+            continue
+        except KeyboardInterrupt:
+            print('Stopping self-play, waiting for games in progress')
+            stop.set()
+            deadline = time.perf_counter() + Config.shutdown_timeout
+            continue
+        if game_count == None:
+            done[worker_id] = True
+            if payload != None:
+                errors.append('Worker ' + str(worker_id) + ' failed:\n' + payload)
+                print('Worker ' + str(worker_id) + ' failed, stopping self-play after the games in progress')
+                if deadline == None:
+                    stop.set()
+                    deadline = time.perf_counter() + Config.shutdown_timeout
+            continue
+        storage.save_game(payload)
+        games[worker_id] += 1
+        moves[worker_id] += len(payload.node_visits)
+        hours = (time.perf_counter() - t0) / 3600
+        print('Worker ' + str(worker_id) + ' finished game ' + str(game_count) + ' (' + str(games[worker_id]) + ' games, '
+            + str(round(games[worker_id] / hours, 1)) + ' games/hour, ' + str(round(moves[worker_id] / hours)) + ' moves/hour)')
+
+    #Ending workers which outlast the timeout
+    for worker in workers:
+        worker.join(timeout=max(0, deadline - time.perf_counter()) if deadline != None else None)
+        if worker.is_alive():
+            worker.terminate()
+
+    if server and server.check():
+        print('Inference server: ' + str(server.metrics()))
+        server.stop()
+    hours = (time.perf_counter() - t0) / 3600
+    print('Self-play finished ' + str(sum(games)) + ' games with ' + str(num_workers) + ' workers ('
+        + str(round(sum(games) / hours, 1)) + ' games/hour, ' + str(round(sum(moves) / hours)) + ' moves/hour)')
+    if errors:
+        raise RuntimeError('Self-play workers failed:\n' + '\n'.join(errors))
+    return sum(games)
+
+
+#Worker process of self_play, playing the games taken from game_counts until none are left or stop is set
+#and sending back (worker_id, game_count, record) for every game, then (worker_id, None, error) however it ends,
+#error being the traceback of what it failed with or None
+#Positions are evaluated by the inference server through client when one is given, else by a network of its own
+def self_play_worker(worker_id, config, game_counts, results, stop, client=None):
+    error = None
+    try:
+        #Interrupts are handled by the parent, which lets the current game finish
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        load_config(config)
+        network = client if client != None else Network()
+        while not stop.is_set():
+            try:
+                game_count = game_counts.get_nowait()
+            except queue.Empty:
+                break
+            game = simulate_game(network, game_count)
+            results.put((worker_id, game_count, GameRecord(game)))
+    except BaseException:
+        error = traceback.format_exc()
+    finally:
+        results.put((worker_id, None, error))
+
 
 def simulate_game(network, game_count):
-    game = Game()
+    game = BitboardGame() if Config.bitboard_engine else Game()
     move_count = 1
+    #Trees kept for the next searches, [tree, table, moves executed since the search] by the color that reuses them
+    searches = {}
     print('Starting Game ' + str(game_count))
     #While the game is still ongoing, run the MCTS, finding a new move
     while game.status == None and game.full_move_count < Config.max_moves:
         t0 = time.perf_counter()
-        next_move, root = mcts(network, game, game_count, move_count)
+        key = None if Config.reuse_opponent_tree else game.color_to_move
+        tree, table = None, None
+        if key in searches:
+            tree, table, moves = searches.pop(key)
+            if reuse_subtree(tree, table, moves):
+                print('  Reusing ' + str(tree.visit_count[tree.root]) + ' visits (Game ' + str(game_count) + ', Move ' + str(move_count) + ')')
+            else: tree, table = None, None
+        next_move, tree, table = mcts(network, game, game_count, move_count, tree, table)
+        if Config.reuse_tree:
+            searches[key] = [tree, table, []]
+            for search in searches.values():
+                search[2].append(next_move)
         #Executing the found move in the current game
         game.execute_move(next_move)
         move_count+=1
         t1 = time.perf_counter()
         print('    Executing Move ' + str(game.full_move_count) + ' for game ' + str(game_count) + 
         ' (' + str(round(t1 - t0,2)) + ' seconds)')
-        game.update_stats(root)
+        edges = tree.edges(tree.root)
+        game.update_stats(tree.edge_move[edges], tree.visit_count[tree.edge_child[edges]])
 
+    cache = network.evaluation_cache
+    if cache != None:
+        print('  Evaluation cache hit rate ' + str(round(100 * cache.hit_rate(), 1)) + '% (' + str(len(cache)) + ' positions, Game '
+            + str(game_count) + ')')
     return game
 
 
-def mcts(network, game, game_count, move_count):
-    root = Node(0)
-    evaluate(network, game, root)
-    add_exploration_noise(root)
-    root.color_to_move = game.color_to_move
-
-    #Running specific amount of simulations, finding/expanding a leaf node for every simulation
-    for i in range(Config.num_simulations):
-        node = root
-        temp_game = copy.deepcopy(game)
-        search_path = [node]
-        child_count, sim_count = 1, i+1
-        #If the node is already expanded, we select a child node for the next move and update our search path
-        while node.expanded():
-            
-            print('Selecting child ' + str(child_count) + ' for simulation ' + str(sim_count)
-                + ' (Game ' + str(game_count) + ', Move ' + str(move_count) + ')')
-            child_count+=1
-            next_move, node = select_child(node)
-            temp_game.execute_move(next_move)
-            search_path.append(node)
-
-        #When we reach a node which has not been expanded, we evaluate and expand the node then update values for 
-        #The nodes in our search path, all the way back to the root node
-        value = evaluate(network, temp_game, node)
-        backpropagate(search_path, value, temp_game.color_to_move)
-
-    return select_next_move(game, root), root
-
-
-def evaluate(network, game, node):
-    #Predicting move probabilities and game outcome using current network model
-    policy_output, value = network.predict(game.encode_input())
-    node.color_to_move = game.color_to_move
-
-    #Setting our policy dictionary with the key being a legal move and the value being the probability prediction from the network
-    policy = {move: math.exp(policy_output[move]) for move in game.get_legal_indexes()}
-    policy_sum = sum(policy.values())
-    #Normalizing policy probabilities and initializing child nodes for our parent node being evaluated
-    for move, p in policy.items():
-        node.children[move] = Node(p / policy_sum)
+#Default of the search limits standing for the Config limit, so that passing None can mean no limit
+config_limit = object()
+
+
+#Searching from the root of tree, continuing a tree kept from an earlier search when one is given
+#The search runs node_limit simulations or for time_limit seconds, whichever comes first, defaulting to the Config limits
+def mcts(network, game, game_count, move_count, tree=None, table=None, node_limit=config_limit, time_limit=config_limit):
+    t0 = time.perf_counter()
+    node_limit, time_limit, tree, table, forced_move = start_search(network, game, tree, table, node_limit, time_limit)
+    if forced_move != None:
+        print('  Playing forced move')
+        return forced_move, tree, table
+    cache = network.evaluation_cache
+
+    batch_size = max(1, Config.search_batch_size)
+    inputs = numpy.empty((batch_size, 8, 8, 103), dtype=numpy.float32)
+    #Running specific amount of simulations in rounds, each round finding up to batch_size leaf nodes
+    #which are then evaluated together
+    sim_count = 0
+    while not search_finished(tree, sim_count, node_limit, time_limit, time.perf_counter() - t0):
+        leaves = []
+        while len(leaves) < min(batch_size, (node_limit if node_limit != None else math.inf) - sim_count):
+            node, search_path = select_leaf(game, tree, table, sim_count + len(leaves) + 1, game_count, move_count)
+            #Two paths of one round can end on the same leaf, it is evaluated once and the round is cut short
+            if any(node == leaf[0] for leaf in leaves):
+                for _ in range(len(search_path) - 1):
+                    game.unmake_move()
+                break
+            key = game.input_key() if cache != None else None
+            cached = cache.get(key) if cache != None else None
+            #A leaf whose evaluation is cached completes its simulation right away
+            if cached != None:
+                expand(tree, node, game.color_to_move, game.get_legal_indexes(), cached[0])
+                table.put(game.hash, node)
+                backpropagate(tree, search_path, cached[1], game.color_to_move)
+                sim_count += 1
+            else:
+                game.encode_input(inputs[len(leaves):len(leaves) + 1])
+                leaves.append((node, search_path, game.color_to_move, game.get_legal_indexes(), game.hash, key))
+                add_virtual_loss(tree, search_path)
+            #Taking back the moves of this simulation so the next one starts from the root position again
+            for _ in range(len(search_path) - 1):
+                game.unmake_move()
+        if not leaves:
+            continue
+
+        #Evaluating and expanding the leaf nodes, then updating values for the nodes in their search paths,
+        #all the way back to the root node
+        policy_outputs, values = network.predict_batch(inputs[:len(leaves)])
+        for (node, search_path, color_to_move, legal_indexes, hash, key), policy_output, value in zip(leaves, policy_outputs, values):
+            legal_logits = policy_output[legal_indexes]
+            if cache != None:
+                cache.put(key, legal_logits, value)
+            expand(tree, node, color_to_move, legal_indexes, legal_logits)
+            table.put(hash, node)
+            backpropagate(tree, search_path, value, color_to_move, Config.virtual_loss)
+        sim_count += len(leaves)
+
+    elapsed = time.perf_counter() - t0
+    print('  Searched ' + str(sim_count) + ' simulations in ' + str(round(elapsed, 2)) + ' seconds ('
+        + str(round(sim_count / elapsed)) + ' simulations/second)')
+    return select_next_move(game, tree), tree, table
+
+
+#Setting up a search of game shared by mcts and parallel_mcts, returning the limits with their defaults filled in,
+#the tree (a new one unless tree is given) with its root evaluated and noised, its table, and the move when it is forced
+def start_search(network, game, tree, table, node_limit, time_limit):
+    node_limit = Config.num_simulations if node_limit is config_limit else node_limit
+    time_limit = Config.search_time_limit if time_limit is config_limit else time_limit
+    if node_limit == None and time_limit == None:
+        raise ValueError('A search needs a node limit, a time limit or both')
+    #Descending the tree replays the same moves every simulation, the shared table spares regenerating their legal moves
+    if Config.legal_move_cache_size and Game.legal_move_table == None:
+        Game.legal_move_table = LegalMoveTable(Config.legal_move_cache_size)
+    if tree == None:
+        tree = Tree()
+        table = TranspositionTable(tree)
+    root = tree.root
+    #A forced move needs no search, nor an evaluation to rank it
+    legal_indexes = game.get_legal_indexes()
+    if len(legal_indexes) == 1:
+        if not tree.expanded(root):
+            expand(tree, root, game.color_to_move, legal_indexes, numpy.zeros(1))
+        return node_limit, time_limit, tree, table, legal_indexes[0]
+    if not tree.expanded(root):
+        evaluate(network, game, tree, root)
+        table.put(game.hash, root)
+    add_exploration_noise(tree, root)
+    return node_limit, time_limit, tree, table, None
+
+
+#Whether a search which ran sim_count simulations in elapsed seconds is over, because it reached a limit or because
+#the most visited root move leads the next by more visits than the simulations left, estimated from the rate so far
+#when time limits the search
+def search_finished(tree, sim_count, node_limit, time_limit, elapsed):
+    if (node_limit != None and sim_count >= node_limit) or (time_limit != None and elapsed >= time_limit):
+        return True
+    if not Config.early_stopping:
+        return False
+    remaining = node_limit - sim_count if node_limit != None else math.inf
+    if time_limit != None:
+        if sim_count == 0:
+            return False
+        remaining = min(remaining, sim_count / elapsed * (time_limit - elapsed))
+    visit_counts = numpy.sort(tree.visit_count[tree.edge_child[tree.edges(tree.root)]])
+    return len(visit_counts) > 1 and visit_counts[-1] - visit_counts[-2] > remaining
+
+
+#Evaluating the leaves submitted by the threads of one search in shared batches, in a thread of its own
+#Requests are (inputs, future) or None to stop, the future is given the (policy_outputs, values) of the inputs
+class BatchEvaluator(object):
+    def __init__(self, network, max_batch, max_wait=None):
+        self.network = network
+        self.max_batch = max_batch
+        self.max_wait = max_wait if max_wait != None else Config.inference_max_wait
+        self.requests = queue.Queue()
+        #Threads searching their own trees have nothing to lock a shared cache with
+        self.evaluation_cache = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def predict(self, input):
+        policy_outputs, values = self.predict_batch(input)
+        return policy_outputs[0], values[0]
+
+    def predict_batch(self, inputs):
+        future = concurrent.futures.Future()
+        self.requests.put((inputs, future))
+        return future.result()
 
+    def run(self):
+        pending = []
+        while True:
+            request = pending.pop() if pending else self.requests.get()
+            if request == None:
+                break
+            batch = gather_batch(self.requests, request, pending, self.max_batch, self.max_wait, lambda request: request[0])[0]
+            try:
+                policy_outputs, values = self.network.predict_batch(numpy.concatenate([inputs for inputs, _ in batch]))
+            except Exception as error:
+                for _, future in batch:
+                    future.set_exception(error)
+                continue
+            start = 0
+            for inputs, future in batch:
+                future.set_result((policy_outputs[start:start + len(inputs)], values[start:start + len(inputs)]))
+                start += len(inputs)
+
+    def stop(self):
+        self.requests.put(None)
+        self.thread.join()
+
+
+#Searching one position with num_threads threads sharing one tree, each descending on a clone of game
+#Only the leaf evaluations run in parallel: selection, expansion and backpropagation hold one lock over the tree,
+#tables and cache, as growing the flat tree arrays replaces them under every other thread. The threads wait for their
+#evaluations without it while the virtual loss on their paths steers the others elsewhere
+def parallel_mcts(network, game, num_threads=None, node_limit=config_limit, time_limit=config_limit, tree=None, table=None):
+    num_threads = num_threads or Config.search_threads
+    t0 = time.perf_counter()
+    node_limit, time_limit, tree, table, forced_move = start_search(network, game, tree, table, node_limit, time_limit)
+    if forced_move != None:
+        return forced_move, tree, table
+    cache = network.evaluation_cache
+
+    lock = threading.Lock()
+    evaluator = BatchEvaluator(network, num_threads)
+    #Simulations started and finished, and the leaves waiting for their evaluation with the event set once they are expanded
+    counts = {'started': 0, 'finished': 0}
+    pending = {}
+
+    def search(thread_game):
+        inputs = numpy.empty((1, 8, 8, 103), dtype=numpy.float32)
+        while True:
+            with lock:
+                if (node_limit != None and counts['started'] >= node_limit) or search_finished(
+                        tree, counts['finished'], node_limit, time_limit, time.perf_counter() - t0):
+                    return
+                node, search_path = select_leaf(thread_game, tree, table, counts['started'] + 1, 0, 0)
+                waiting = pending.get(node)
+                key = thread_game.input_key() if cache != None else None
+                cached = cache.get(key) if cache != None and waiting == None else None
+                color_to_move, legal_indexes, hash = thread_game.color_to_move, thread_game.get_legal_indexes(), thread_game.hash
+                if waiting == None and cached != None:
+                    expand(tree, node, color_to_move, legal_indexes, cached[0])
+                    table.put(hash, node)
+                    backpropagate(tree, search_path, cached[1], color_to_move)
+                    counts['started'] += 1
+                    counts['finished'] += 1
+                elif waiting == None:
+                    pending[node] = threading.Event()
+                    add_virtual_loss(tree, search_path)
+                    counts['started'] += 1
+            if waiting != None or cached != None:
+                for _ in range(len(search_path) - 1):
+                    thread_game.unmake_move()
+                #Another thread is evaluating this leaf, the search continues once it is expanded
+                if waiting != None:
+                    waiting.wait()
+                continue
+            thread_game.encode_input(inputs)
+            for _ in range(len(search_path) - 1):
+                thread_game.unmake_move()
+            try:
+                policy_outputs, values = evaluator.predict_batch(inputs)
+            except Exception:
+                #Releasing the threads waiting on this leaf, the error ends the search
+                with lock:
+                    pending.pop(node).set()
+                raise
+            legal_logits = policy_outputs[0][legal_indexes]
+            with lock:
+                if cache != None:
+                    cache.put(key, legal_logits, values[0])
+                expand(tree, node, color_to_move, legal_indexes, legal_logits)
+                table.put(hash, node)
+                backpropagate(tree, search_path, values[0], color_to_move, Config.virtual_loss)
+                counts['finished'] += 1
+                pending.pop(node).set()
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(num_threads) as executor:
+            searches = [executor.submit(search, game.clone()) for _ in range(num_threads)]
+        for thread_search in searches:
+            thread_search.result()
+    finally:
+        evaluator.stop()
+
+    elapsed = time.perf_counter() - t0
+    print('  Searched ' + str(counts['finished']) + ' simulations with ' + str(num_threads) + ' threads in ' + str(round(elapsed, 2))
+        + ' seconds (' + str(round(counts['finished'] / elapsed)) + ' simulations/second)')
+    return select_next_move(game, tree), tree, table
+
+
+#Searching one position with num_threads independent trees, one per thread and each within the limits, whose root
+#visits are then added up, returning the move chosen from the merged visits and a tree holding the merged root
+def root_parallel_mcts(network, game, num_threads=None, node_limit=config_limit, time_limit=config_limit):
+    num_threads = num_threads or Config.search_threads
+    t0 = time.perf_counter()
+    evaluator = BatchEvaluator(network, num_threads * max(1, Config.search_batch_size))
+    try:
+        with concurrent.futures.ThreadPoolExecutor(num_threads) as executor:
+            searches = [executor.submit(mcts, evaluator, game.clone(), 0, 0, node_limit=node_limit, time_limit=time_limit)
+                for _ in range(num_threads)]
+        trees = [search.result()[1] for search in searches]
+    finally:
+        evaluator.stop()
+    tree = merge_roots(trees)
+    elapsed = time.perf_counter() - t0
+    sim_count = sum(int(tree.visit_count[tree.root]) for tree in trees)
+    print('  Searched ' + str(sim_count) + ' simulations in ' + str(num_threads) + ' trees in ' + str(round(elapsed, 2))
+        + ' seconds (' + str(round(sim_count / elapsed)) + ' simulations/second)')
+    return select_next_move(game, tree), tree
+
+
+#Tree holding only a root, whose children carry the summed statistics of the root children of trees
+#searched from the same position, which all expanded their root with the same legal moves in the same order
+def merge_roots(trees):
+    merged = Tree()
+    first = trees[0]
+    edges = first.edges(first.root)
+    merged.color_to_move[merged.root] = first.color_to_move[first.root]
+    merged.add_children(merged.root, first.edge_move[edges], first.edge_prior[edges])
+    children = merged.edge_child[merged.edges(merged.root)]
+    for tree in trees:
+        tree_children = tree.edge_child[tree.edges(tree.root)]
+        merged.visit_count[children] += tree.visit_count[tree_children]
+        merged.value_sum[children] += tree.value_sum[tree_children]
+        merged.visit_count[merged.root] += tree.visit_count[tree.root]
+        merged.value_sum[merged.root] += tree.value_sum[tree.root]
+    return merged
+
+
+#Making the node reached from the root through moves the new root, keeping its statistics and subtree
+#Returns False when the tree never expanded that line
+def reuse_subtree(tree, table, moves):
+    node = tree.root
+    for move in moves:
+        node = tree.child(node, move) if tree.expanded(node) else None
+        if node == None:
+            return False
+    tree.root = node
+    #Entries of positions left behind could link back to an ancestor of the new root and loop the search
+    table.keep(tree.reachable(node))
+    return True
+
+
+#Descending from the root to a node which has not been expanded, playing the moves along the way on game
+def select_leaf(game, tree, table, sim_count, game_count, move_count):
+    node = tree.root
+    search_path = [node]
+    child_count = 1
+    #If the node is already expanded, we select a child node for the next move and update our search path
+    while tree.expanded(node):
+
+        print('Selecting child ' + str(child_count) + ' for simulation ' + str(sim_count)
+            + ' (Game ' + str(game_count) + ', Move ' + str(move_count) + ')')
+        child_count+=1
+        next_move, node, edge = select_child(tree, node)
+        game.make_move(next_move)
+        node = follow_transposition(tree, table, game, edge, node, search_path)
+        search_path.append(node)
+    return node, search_path
+
+
+#Node a descent continues with after playing the move of edge, whose child is node
+#An unexpanded node is swapped for the node (and statistics) of the same position when another move order already
+#reached it. A node is never followed when it is already on search_path: links made from other paths can lead back
+#onto this one, where the descent would loop through the repetition forever, so the edge gets a node of its own
+def follow_transposition(tree, table, game, edge, node, search_path):
+    if node in search_path:
+        tree.edge_child[edge] = node = int(tree.add_nodes(1)[0])
+    if not tree.expanded(node):
+        shared = table.get(game.hash)
+        if shared != None and shared != node and shared not in search_path:
+            tree.edge_child[edge] = node = shared
+    return node
+
+
+def evaluate(network, game, tree, node):
+    cache = network.evaluation_cache
+    key = game.input_key() if cache != None else None
+    cached = cache.get(key) if cache != None else None
+    if cached != None:
+        legal_logits, value = cached
+    else:
+        #Predicting move probabilities and game outcome using current network model
+        policy_output, value = network.predict(game.encode_input())
+        legal_logits = policy_output[game.get_legal_indexes()]
+        if cache != None:
+            cache.put(key, legal_logits, value)
+    expand(tree, node, game.color_to_move, game.get_legal_indexes(), legal_logits)
     return value
 
 
-def select_child(node):
-    max, res = None, ()
-    #Loops over the node.children dictionary kay/value pairs returning the key(move) and value(child node) with highest UCB score
-    for move, child in node.children.items():
-        score = ucb_score(node, child)
-        if max == None or score > max:
-            res, max = (move, child), score
-    return res
+#Initializing the children of node from the network's logits for its legal moves, in the order of legal_indexes
+def expand(tree, node, color_to_move, legal_indexes, legal_logits):
+    tree.color_to_move[node] = color_to_move
+    #Normalizing the predicted probabilities of the legal moves and initializing child nodes with them
+    if legal_indexes:
+        policy = numpy.exp(numpy.asarray(legal_logits, dtype=numpy.float64))
+        tree.add_children(node, legal_indexes, policy / policy.sum())
+
 
+#Returning the move, child node and edge with the highest UCB score among the children of node
+def select_child(tree, node):
+    edges = tree.edges(node)
+    edge = edges.start + int(numpy.argmax(ucb_scores(tree, node, edges)))
+    return int(tree.edge_move[edge]), int(tree.edge_child[edge]), edge
 
-def select_next_move(game, root):
+
+def select_next_move(game, tree):
     print('  Selecting Move')
-    visit_counts = [(child.visit_count, move) for move, child in root.children.items()]
-    child_visit_count, next_move = max(visit_counts)
-    return next_move
+    edges = tree.edges(tree.root)
+    moves, visit_counts = tree.edge_move[edges], tree.visit_count[tree.edge_child[edges]]
+    #Most visited move, ties going to the highest move index
+    return int(moves[visit_counts == visit_counts.max()].max())
 
 
 # The score for a node is based on its value, plus an exploration bonus based on the prior
-def ucb_score(parent, child):
-    pb_c = math.log((parent.visit_count + Config.pb_c_base + 1) /
+#The parent term is computed once and the scores of all children, through the edges of parent, at once
+def ucb_scores(tree, parent, edges):
+    children = tree.edge_child[edges]
+    parent_visits = tree.visit_count[parent]
+    pb_c = math.log((parent_visits + Config.pb_c_base + 1) /
                   Config.pb_c_base) + Config.pb_c_init
-    pb_c *= math.sqrt(parent.visit_count) / (child.visit_count + 1)
+    pb_c *= math.sqrt(parent_visits)
+
+    visit_counts = tree.visit_count[children]
+    prior_scores = pb_c * tree.edge_prior[edges] / (visit_counts + 1)
+    value_scores = numpy.divide(tree.value_sum[children], visit_counts, out=numpy.zeros(len(children)), where=visit_counts > 0)
+    return prior_scores + value_scores
 
-    prior_score = pb_c * child.prior
-    value_score = child.value()
-    return prior_score + value_score
 
+#Counting visits on a path whose leaf is still waiting for its evaluation, without any value,
+#which lowers the scores select_child gives its nodes until backpropagate takes the visits back
+def add_virtual_loss(tree, search_path):
+    tree.visit_count[search_path] += Config.virtual_loss
 
-def backpropagate(search_path, value, color_to_move):
-    for node in search_path:
-        #Running back up the search tree updating the search path with the freshly found leaf node value
-        #Adding value for same color_to_move nodes, adding 1 - value for opponent move nodes
-        if node.color_to_move == color_to_move:
-            node.value_sum += value
-        else: node.value_sum += (1 - value)
-        #Updating the node visit count
-        node.visit_count += 1
 
+def backpropagate(tree, search_path, value, color_to_move, virtual_loss = 0):
+    #Running back up the search tree updating the search path with the freshly found leaf node value
+    #Adding value for same color_to_move nodes, adding 1 - value for opponent move nodes
+    tree.value_sum[search_path] += numpy.where(tree.color_to_move[search_path] == color_to_move, value, 1 - value)
+    #Updating the node visit counts, taking back the virtual loss the path was given
+    tree.visit_count[search_path] += 1 - virtual_loss
 
-def add_exploration_noise(node):
-  moves = node.children.keys()
-  noise = numpy.random.gamma(Config.root_dirichlet_alpha, 1, len(moves))
+
+def add_exploration_noise(tree, node):
+  #The noise goes on the root's edges, the child nodes may be shared with other parents
+  edges = tree.edges(node)
+  noise = numpy.random.gamma(Config.root_dirichlet_alpha, 1, edges.stop - edges.start)
   frac = Config.root_exploration_fraction
-  for move, n in zip(moves, noise):
-    node.children[move].prior = node.children[move].prior * (1 - frac) + n * frac
+  tree.edge_prior[edges] = tree.edge_prior[edges] * (1 - frac) + noise * frac
 
 
 
 def train(network, storage):
+    t0 = time.perf_counter()
     for i in range(Config.training_steps):
         if i % Config.checkpoint_interval == 0:
             network.save()
         batch = storage.sample_batch()
-        update_weights(network, batch)
+        value_loss, policy_loss, l2_loss = update_weights(network, batch)
+        if (i + 1) % Config.training_log_interval == 0:
+            print('Training step ' + str(i + 1) + ': value loss ' + str(round(value_loss, 4)) + ', policy loss ' + str(round(policy_loss, 4))
+                + ', weight decay loss ' + str(round(l2_loss, 4)) + ' (' + str(round((i + 1) / (time.perf_counter() - t0), 2)) + ' steps/second)')
+    #Cached evaluations came from the weights before this training
+    if network.evaluation_cache != None:
+        network.evaluation_cache.clear()
     #What is the point of saving the networks? Potential fallback?
     #storage.save_network(Config.training_steps, network)
 
 
+#One step on a batch of (images, value targets, target moves, target probabilities), in a single forward pass
 def update_weights(network, batch):
-    loss = 0
-    optimizer = tf.keras.optimizers.SGD(Config.learning_rate, Config.momentum, nesterov=False, name='SGD')
-    for image, (target_value, target_policy) in batch:
-        policy_output, value = network.predict(image)
-        loss += (
-            tf.losses.mean_squared_error(value, target_value) +
-            tf.nn.softmax_cross_entropy_with_logits(
-                logits=policy_output, labels=target_policy))
-
-    for weights in network.get_weights():
-        loss += Config.weight_decay * tf.nn.l2_loss(weights)
+    return network.train_step(*batch)
 
-    optimizer.minimize(loss)
 
-    
-    
-    
-#Using something like this you can save games to text files for deeper research or understanding
+#Using something like this you can save games to a record file for deeper research or understanding
+#(records.read_games replays them, with their network inputs, for Storage)
 #
 #
 #
 #network = Network()
-#for i in range(1,1000):
-#   info = []
-#    game = simulate_game(network, i)
-#    info = [game.encoding_history, game.node_visits, game.status]
-#    storage.save_game(game)
-#    f = open('saved_games.txt', 'a')
-#    f.write(str(info))
-#    f.write('/')
-#    f.close()
+#with records.GameWriter('saved_games.spgr') as writer:
+#    for i in range(1,1000):
+#        game = simulate_game(network, i)
+#        storage.save_game(game)
+#        writer.write(game)
 #train(network, storage)
 
 
+#This code plays games in parallel on every core and trains the network on them
+#if __name__ == '__main__':
+#    storage = Storage()
+#    self_play(storage, 100)
+#    train(Network(), storage)
+
+
 #This code runs a single game simulation and trains the network
 #storage = Storage()
 #network = Network()
@@ -0,0 +1,110 @@
+from game import Game, fen_initial
+from bitboard import BitboardGame
+import argparse, sys, time
+
+
+#Standard perft positions with their published node counts
+#The network only has knight and queen promotions, so counts are only listed for depths where no promotion can happen yet
+positions = [
+    ('initial', fen_initial,
+        {1: 20, 2: 400, 3: 8902, 4: 197281, 5: 4865609}),
+    ('kiwipete', 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+        {1: 48, 2: 2039, 3: 97862}),
+    ('position 3', '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+        {1: 14, 2: 191, 3: 2812, 4: 43238, 5: 674624}),
+    ('position 6', 'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+        {1: 46, 2: 2079, 3: 89890, 4: 3894594}),
+]
+
+#Positions where promotions come up early, their published counts include bishop and rook promotions
+#so instead both engines are checked against each other
+cross_check_positions = [
+    ('position 4', 'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1'),
+    ('position 5', 'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8'),
+]
+
+engines = {'game': Game, 'bitboard': BitboardGame}
+
+
+#Counting the leaf nodes of the legal move tree to the given depth, playing and taking back every move
+#The moves are generated at every node, get_legal_moves would read the root moves load_fen already cached
+def perft(game, depth):
+    legal_moves = game.generate_legal_moves()
+    if depth == 1:
+        return len(legal_moves)
+    nodes = 0
+    for move in legal_moves:
+        game.make_move(move, update_status=False)
+        nodes += perft(game, depth - 1)
+        game.unmake_move()
+    return nodes
+
+
+#Perft split by first move, the usual way to find which move an engine gets wrong
+def divide(game, depth):
+    counts = {}
+    for move in game.get_legal_moves():
+        game.make_move(move, update_status=False)
+        counts[(move.start_tile, move.end_tile, move.promotion)] = perft(game, depth - 1) if depth > 1 else 1
+        game.unmake_move()
+    return counts
+
+
+#Running perft on every position up to max_depth, printing node counts, timings and nodes/second
+#Returns the list of (engine, position, depth, nodes, expected) that did not match
+def run(engine_names = ('game', 'bitboard'), max_depth = 4, cross_check_depth = 3):
+    failures = []
+    for engine_name in engine_names:
+        print('Engine: ' + engine_name)
+        for name, fen, counts in positions:
+            game = engines[engine_name](fen)
+            for depth in sorted(counts):
+                if depth > max_depth:
+                    break
+                t0 = time.perf_counter()
+                nodes = perft(game, depth)
+                t1 = time.perf_counter()
+                result = 'ok' if nodes == counts[depth] else 'FAILED (expected ' + str(counts[depth]) + ')'
+                print('  ' + name + ' depth ' + str(depth) + ': ' + str(nodes) + ' nodes in '
+                    + str(round(t1 - t0, 3)) + ' seconds (' + str(round(nodes / max(t1 - t0, 1e-9))) + ' nodes/second) ' + result)
+                if nodes != counts[depth]:
+                    failures.append((engine_name, name, depth, nodes, counts[depth]))
+
+    if len(engine_names) > 1:
+        print('Cross check: ' + ' vs '.join(engine_names))
+        for name, fen in cross_check_positions:
+            for depth in range(1, min(cross_check_depth, max_depth) + 1):
+                results = [perft(engines[engine_name](fen), depth) for engine_name in engine_names]
+                result = 'ok' if len(set(results)) == 1 else 'FAILED'
+                print('  ' + name + ' depth ' + str(depth) + ': ' + ' / '.join(str(nodes) for nodes in results) + ' ' + result)
+                if len(set(results)) != 1:
+                    failures.append(('cross check', name, depth, results, None))
+    return failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Perft node counts and speed of the move generators')
+    parser.add_argument('--engine', choices=['game', 'bitboard', 'both'], default='both')
+    parser.add_argument('--depth', type=int, default=4, help='deepest depth to run on the standard positions')
+    parser.add_argument('--fen', help='only print perft (or divide) of this position up to --depth')
+    parser.add_argument('--divide', action='store_true', help='split the count of --fen by first move')
+    args = parser.parse_args()
+    engine_names = ['game', 'bitboard'] if args.engine == 'both' else [args.engine]
+
+    if args.fen:
+        for engine_name in engine_names:
+            game = engines[engine_name](args.fen)
+            if args.divide:
+                for move, nodes in sorted(divide(game, args.depth).items(), key=lambda item: str(item[0])):
+                    print(engine_name + ' ' + str(move) + ': ' + str(nodes))
+            for depth in range(1, args.depth + 1):
+                t0 = time.perf_counter()
+                nodes = perft(game, depth)
+                print(engine_name + ' depth ' + str(depth) + ': ' + str(nodes) + ' nodes in ' + str(round(time.perf_counter() - t0, 3)) + ' seconds')
+        sys.exit(0)
+
+    failures = run(engine_names, args.depth)
+    if failures:
+        print(str(len(failures)) + ' perft check(s) failed')
+        sys.exit(1)
+    print('All perft checks passed')
@@ -0,0 +1,103 @@
+from game import Game
+import numpy, struct, zlib
+
+
+#Binary self-play game records: a file is the magic bytes followed by one record per game, each a 4 byte length
+#and the zlib compressed record, which holds the starting FEN, the result, the move indexes played and for every
+#move the root moves visited by the search with their visit counts
+#Network inputs and visit distributions are not stored, read_games derives them again by replaying the moves
+magic = b'SPGR\x01'
+#Stored result of a game which was stopped before it ended
+unfinished = 127
+
+
+#Move indexes played in game, from Game.executed_moves or the move_indexes of a learning.GameRecord
+def move_indexes(game):
+    if hasattr(game, 'move_indexes'):
+        return game.move_indexes
+    return [move.index() for move in game.executed_moves]
+
+
+#Record of a finished Game (or learning.GameRecord) as bytes
+def encode_game(game):
+    if game.start_fen == None:
+        raise ValueError('Game has no starting FEN, records can only be made of games played from a FEN')
+    fen = game.start_fen.encode()
+    moves = numpy.asarray(move_indexes(game), dtype='<u2')
+    visited = numpy.array([len(root_moves) for root_moves, _ in game.root_visits], dtype='<u2')
+    root_moves = numpy.concatenate([root_moves for root_moves, _ in game.root_visits] or [[]]).astype('<u2')
+    visit_counts = numpy.concatenate([counts for _, counts in game.root_visits] or [[]]).astype('<u4')
+    result = unfinished if game.status == None else int(game.status)
+    record = (struct.pack('<HbHH', len(fen), result, len(moves), len(visited)) + fen + moves.tobytes() + visited.tobytes()
+        + root_moves.tobytes() + visit_counts.tobytes())
+    return zlib.compress(record, 9)
+
+
+#(start FEN, result, move indexes, [(root moves, visit counts)] per searched move) of a record made by encode_game
+def decode_game(data):
+    record = zlib.decompress(data)
+    fen_length, result, move_count, root_count = struct.unpack_from('<HbHH', record)
+    offset = struct.calcsize('<HbHH')
+    fen = record[offset:offset + fen_length].decode()
+    offset += fen_length
+    moves = numpy.frombuffer(record, dtype='<u2', count=move_count, offset=offset)
+    offset += 2 * move_count
+    visited = numpy.frombuffer(record, dtype='<u2', count=root_count, offset=offset)
+    offset += 2 * root_count
+    total = int(visited.sum())
+    root_moves = numpy.frombuffer(record, dtype='<u2', count=total, offset=offset)
+    visit_counts = numpy.frombuffer(record, dtype='<u4', count=total, offset=offset + 2 * total)
+    ends = numpy.cumsum(visited)
+    root_visits = [(root_moves[end - length:end], visit_counts[end - length:end]) for length, end in zip(visited, ends)]
+    return fen, None if result == unfinished else result, moves.tolist(), root_visits
+
+
+#Appending records of games to a file, creating it with its magic bytes when it does not exist yet
+class GameWriter(object):
+    def __init__(self, path):
+        self.file = open(path, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(magic)
+
+    def write(self, game):
+        data = encode_game(game)
+        self.file.write(struct.pack('<I', len(data)) + data)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+#Decoded records of a file written by GameWriter, one at a time
+def read_records(path):
+    with open(path, 'rb') as file:
+        if file.read(len(magic)) != magic:
+            raise ValueError(path + ' is not a game record file')
+        while True:
+            header = file.read(4)
+            if len(header) < 4:
+                return
+            yield decode_game(file.read(struct.unpack('<I', header)[0]))
+
+
+#Games of a record file replayed on game_class, with their network inputs and visit distributions derived again
+#so they can be saved to learning.Storage
+def read_games(path, game_class=Game):
+    for fen, result, moves, root_visits in read_records(path):
+        game = game_class(fen)
+        for move, (root_moves, visit_counts) in zip(moves, root_visits):
+            game.update_stats(root_moves.astype(numpy.int64), visit_counts)
+            game.execute_move(int(move))
+        game.status = result
+        yield game
+
+
+def write_games(path, games):
+    with GameWriter(path) as writer:
+        for game in games:
+            writer.write(game)
@@ -0,0 +1,36 @@
+from learning import Config, Network, parallel_mcts, root_parallel_mcts
+from game import fen_initial
+from bitboard import BitboardGame
+import argparse, contextlib, io, time
+
+
+searches = {'tree': parallel_mcts, 'root': root_parallel_mcts}
+
+
+#Simulations per second of one search of game with the given threads, the printing of the search is left out
+def simulations_per_second(search, network, game, threads, simulations, seconds):
+    with contextlib.redirect_stdout(io.StringIO()):
+        t0 = time.perf_counter()
+        tree = search(network, game, threads, node_limit=simulations, time_limit=seconds)[1]
+        elapsed = time.perf_counter() - t0
+    return tree.visit_count[tree.root] / elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulations per second of the parallel searches by thread count')
+    parser.add_argument('--search', choices=['tree', 'root', 'both'], default='both')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--simulations', type=int, default=800, help='simulations per search, split between the trees of a root search')
+    parser.add_argument('--seconds', type=float, help='time limit of each search')
+    parser.add_argument('--fen', default=fen_initial)
+    args = parser.parse_args()
+    search_names = ['tree', 'root'] if args.search == 'both' else [args.search]
+    #Every search runs to its limits so the counts are comparable
+    Config.early_stopping = False
+
+    network = Network()
+    for search_name in search_names:
+        for threads in args.threads:
+            simulations = args.simulations // threads if search_name == 'root' else args.simulations
+            rate = simulations_per_second(searches[search_name], network, BitboardGame(args.fen), threads, simulations, args.seconds)
+            print(search_name + ' search with ' + str(threads) + ' threads: ' + str(round(rate)) + ' simulations/second')
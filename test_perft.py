@@ -0,0 +1,6 @@
+import perft
+
+
+#Both move generators against the published counts and each other, shallow enough for every test run
+def test_perft():
+    assert perft.run(max_depth=3) == []
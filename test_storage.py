@@ -0,0 +1,25 @@
+import numpy, pytest
+
+learning = pytest.importorskip('learning')
+
+
+#Stand-in for a finished game with positions positions, all with the same visit distribution
+class FinishedGame(object):
+    def __init__(self, positions):
+        self.encoding_history = [numpy.zeros((1, 8, 8, 103), dtype=numpy.float32) for _ in range(positions)]
+        self.node_visits = [(numpy.array([0, 1], dtype=numpy.uint16), numpy.array([0.5, 0.5], dtype=numpy.float32))] * positions
+        self.status = 0
+
+
+#Halving the weight of every older game keeps the draws on the newest ones, also once more games have been saved
+#than the game arrays hold and their weights have been rescaled along the way
+def test_recency_sampling():
+    storage = learning.Storage(window_positions=3000, window_size=1000, recency=0.5)
+    with numpy.errstate(over='raise', invalid='raise'):
+        for _ in range(2500):
+            storage.save_game(FinishedGame(3))
+        slots = storage.sample_slots(2000)
+    assert numpy.isfinite(storage.game_cumulative).all()
+    game_ids = storage.game_ids[slots]
+    assert game_ids.min() >= 2500 - 30
+    assert (game_ids == 2499).mean() > 0.4